@@ -5,36 +5,41 @@ from concurrent.futures import ThreadPoolExecutor
 import netmiko
 import os
 import datetime
-from threading import Lock
-import pandas as pd
+import queue
+from threading import Thread
+import openpyxl
+import encodings.idna  # noqa: F401  预加载 idna 编解码器，线程中首次连接不再触发导入
 
 class net_dev():
 
-    def __init__(self,excel_name):
-        try :
-            os.mkdir("./result"+'{0:%Y%m%d}'.format(datetime.datetime.now()))
-        except:
-            pass
+    def __init__(self,excel_name,max_workers=128):
         self.excel_name = excel_name
-        self.list = [] # 空列表存储设备信息数据
-        self.pool = ThreadPoolExecutor(10) # 初始化线程数量
-        self.lock = Lock()  # 添加线程锁，避免写入数据丢失
-        self.path = ("./result"+'{0:%Y%m%d}'.format(datetime.datetime.now()))  # 创建保存result路径
+        self.max_workers = max_workers # 并发上限，SSH 属于 I/O 密集，可远大于 CPU 数
+        self.failed_q = queue.SimpleQueue()  # 登录失败记录入队，由单个写线程落盘，不再加锁逐条 open
+        # 创建保存result路径；使用绝对路径，工作线程无需依赖进程级的当前目录
+        self.path = os.path.abspath("./result"+'{0:%Y%m%d}'.format(datetime.datetime.now()))
+        os.makedirs(self.path, exist_ok=True)
+        self.failed_file = os.path.join(self.path, "登录失败列表")
         #self.mult_config=[] # 创建列表，保存多条命令。用于批量执行命令
 
-    def get_dev_info(self):
-        # 获取sheet(设备信息)的dataframe.
-        df = pd.read_excel(self.excel_name,sheet_name="Sheet1") # 读取excel的sheet1
-        self.list = df.to_dict(orient="records")  # 将数据打印出来，已字典存储的列表数据
-        #self.mult_config = list(df['mult_command'].split(";"))
-        #mult_conf = df["mult_command"].values.tolist()  # 取一列的值生成列表
-        #print(self.list)
+    # 工作线程所需的列，按 mult_cmd_in 的参数顺序排列
+    DEV_COLUMNS = ("host", "username", "device_type", "password", "secret", "mult_command")
 
-        # 获取sheet(CMD)的dataframe
-        #df1 = pd.read_excel(self.excel_name,sheet_name="Sheet1")
-        #result1 = df1.to_dict(orient="list")  # 将数据打印出来,将一列的数据存为一个字典
-        #self.mult_config = result1["mult_command"]
-        #print(self.mult_config)
+    def iter_devices(self):
+        # 只读模式流式读取sheet(设备信息)，逐行产出，边解析边提交线程池
+        # 表头只解析一次得到列下标，之后每行直接按下标取出原始元组，不再逐行构建字典
+        wb = openpyxl.load_workbook(self.excel_name, read_only=True, data_only=True, keep_links=False)
+        try:
+            sheet = wb["Sheet1"]  # 读取excel的sheet1
+            headers = [c.value for c in next(sheet.iter_rows(min_row=1, max_row=1))]
+            idx = [headers.index(col) for col in self.DEV_COLUMNS]
+            for row in sheet.iter_rows(min_row=2, values_only=True):
+                if not any(row):
+                    continue  # 跳过整行空白
+                # 按 DEV_COLUMNS 顺序产出一行设备数据，空单元格统一为空字符串
+                yield tuple("" if row[i] is None else row[i] for i in idx)
+        finally:
+            wb.close()
 
     def mult_cmd_in(self,ip,user,dev_type,passwd,secret,cmds):
         try:
@@ -51,38 +56,54 @@ class net_dev():
                connect_dev.enable()
             #for cmd in cmds:
             cmd_out = connect_dev.send_multiline(cmds)
-            with open (ip + ".txt", "w",encoding="utf-8")  as tmp_fle:
+            with open (os.path.join(self.path, ip + ".txt"), "w",encoding="utf-8")  as tmp_fle:
                  tmp_fle.write(cmd_out+'\n')
             print(ip + " 执行成功")
 
         except netmiko.exceptions.NetmikoAuthenticationException:
-            self.lock.acquire()
-            with open("登录失败列表", "a", encoding="utf-8") as failed_ip:
-                failed_ip.write(ip + "  用户名密码错误\n")
-                print(ip + " 用户名密码错误")
-            self.lock.release()
+            self.failed_q.put(ip + "  用户名密码错误\n")
+            print(ip + " 用户名密码错误")
         except netmiko.exceptions.NetmikoTimeoutException:
-            self.lock.acquire()
-            with open("登录失败列表", "a", encoding="utf-8") as failed_ip:
-                failed_ip.write(ip + "       登录超时\n")
-                print(ip + " 登录超时")
-            self.lock.release()
+            self.failed_q.put(ip + "       登录超时\n")
+            print(ip + " 登录超时")
+
+    def write_failed(self):
+        # 每次取出队列中已积压的全部记录一次写入；收到 None 刷盘退出
+        # 首条失败才打开文件，全部成功时不生成空的失败列表
+        failed_ip = None
+        try:
+            while True:
+                batch = [self.failed_q.get()]
+                while True:
+                    try:
+                        batch.append(self.failed_q.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = [line for line in batch if line is not None]
+                if lines:
+                    if failed_ip is None:
+                        failed_ip = open(self.failed_file, "a", encoding="utf-8")
+                    failed_ip.writelines(lines)
+                    failed_ip.flush()
+                if len(lines) < len(batch):
+                    return
+        finally:
+            if failed_ip is not None:
+                failed_ip.close()
 
     def main(self):
-        for dev_info in self.list:
-            cmds = list(dev_info['mult_command'].split(";"))
-            #print(dev_info)
-            ip = dev_info["host"]
-            #print(ip)
-            user = dev_info["username"]
-            dev_type = dev_info["device_type"]
-            passwd = dev_info["password"]
-            secret = dev_info["secret"]
+        # 线程池推迟到此创建；ThreadPoolExecutor 只在有待执行任务时才起新线程，
+        # 实际线程数 = min(设备数, max_workers)
+        self.pool = ThreadPoolExecutor(self.max_workers)
+        writer = Thread(target=self.write_failed, name="failed-writer", daemon=True)
+        writer.start()
+        for ip, user, dev_type, passwd, secret, mult_command in self.iter_devices():
+            cmds = str(mult_command).split(";")
             self.pool.submit(self.mult_cmd_in,ip,user,dev_type,passwd,secret,cmds)
-        os.chdir(self.path)
         self.pool.shutdown(True)
+        self.failed_q.put(None)
+        writer.join()
 
 filename = input("输入设备信息(excel文件):")
 my_use = net_dev(filename)
-my_use.get_dev_info()
 my_use.main()
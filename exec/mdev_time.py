@@ -1,35 +1,117 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from __future__ import annotations
+
 import os
 import re
 import sys
 import time
-import uuid
+import json
+import pickle
+import hashlib
+import tempfile
+import queue
+import random
+import socket
+import ipaddress
+import atexit
+import logging
+import multiprocessing
 import argparse
 import datetime
-from typing import List, Dict, Optional, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-
-import netmiko
-import openpyxl
-import encodings.idna  # noqa: F401  保留以解决线程下 idna 编码问题
-from tqdm import tqdm
-from netmiko import (
-    NetmikoTimeoutException,
-    NetmikoAuthenticationException,
+import mmap
+import zipfile
+import posixpath
+import threading
+import functools
+import contextlib
+import xml.etree.ElementTree as ET
+from typing import (
+    TYPE_CHECKING, List, Dict, Tuple, NamedTuple, Optional, Any, Callable, Deque, Iterable, Iterator,
+    Sequence,
 )
-from netmiko.ssh_dispatcher import CLASS_MAPPER
+from collections import deque
+from itertools import count, repeat
+from operator import itemgetter
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from threading import Thread
+
+import encodings.idna  # noqa: F401  主线程预加载一次，工作线程直接复用（解决线程下 idna 编码问题）
+
+# netmiko（连带 paramiko/cryptography）、openpyxl、tqdm 在首次用到时才导入，
+# --help、参数/文件校验可立即返回
+if TYPE_CHECKING:
+    import netmiko
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # 可选依赖，未安装时 load_excel 回退到 openpyxl
+    CalamineWorkbook = None
+
+
+def effective_cpu_count() -> int:
+    """容器内实际可用的 CPU 数：取亲和性掩码与 cgroup v2 cpu.max 配额中较小者，
+    os.cpu_count() 返回的是宿主机核数。"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
 
 # ---------------------------------------------------------------------------
 # 环境配置
 # ---------------------------------------------------------------------------
 os.environ["NO_COLOR"] = "1"
-write_lock = Lock()
-DEFAULT_THREADS = min(900, max(4, (os.cpu_count() or 4)))
+# SSH 批量下发是 I/O 密集型，线程大部分时间阻塞在网络读写上，
+# 并发度按待连接设备数而非 CPU 核数取值；实际线程数 = min(设备数, -t)
+DEFAULT_THREADS = 128
+# -t 上限：再往上目标设备/网络先成瓶颈，只剩线程与内存开销；可用环境变量放宽
+MAX_THREADS = int(os.environ.get("MDEV_MAX_THREADS", "512"))
+# 工作线程栈大小：线程只做阻塞式 SSH 读写，无需 Linux 默认的 8 MiB 栈，
+# 收窄到 1 MiB（与 Windows 默认一致）后高并发时的内存占用大幅下降
+WORKER_STACK_SIZE = 1 << 20
+
+# 同时进行 SSH 握手（密钥交换+认证，CPU 开销集中在这一段）的上限，与会话并发 -t 分开：
+# 会话建立后大部分时间只是等待回显，握手却要占 CPU，按核数放量即可
+DEFAULT_CONNECT_THREADS = min(128, max(16, effective_cpu_count() * 4))
+
+# 错误日志：工作线程只把记录放进队列，由 QueueListener 单线程写文件；
+# 监听线程在 main() 里启动，多工作表解析的子进程重新导入本模块时不会各起一份
+ERROR_LOG_FILE = "error_log.txt"
+_error_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_error_file_handler = RotatingFileHandler(
+    ERROR_LOG_FILE, maxBytes=10 << 20, backupCount=3, encoding="utf-8", delay=True,
+)
+_error_file_handler.setFormatter(logging.Formatter("%(message)s"))
+error_logger = logging.getLogger("mdev.error")
+error_logger.addHandler(QueueHandler(_error_log_queue))
+error_logger.propagate = False
+_error_log_listener = QueueListener(_error_log_queue, _error_file_handler)
+
+# 可整批写入命令的 device_type（show 类命令不依赖逐条提示符交互；
+# 均由 Netmiko 会话准备阶段关闭分页）。读回时按提示符逐条计数、每条单独计时，
+# 见 send_command_pipelined。paloalto_panos、huawei_vrpv8 等回显/提示符
+# 不稳定的平台不在此列，仍逐条 send_command
+PIPELINE_TYPES = {
+    'cisco_ios', 'cisco_xe', 'cisco_nxos', 'cisco_xr', 'arista_eos',
+    'huawei', 'hp_comware', 'juniper', 'juniper_junos', 'ruijie_os',
+}
 
-SUPPORTED_DEVICE_TYPES = set(CLASS_MAPPER.keys())
+# Excel 必填列
+REQUIRED_FIELDS = ('host', 'username', 'password', 'device_type')
+_required_values = itemgetter(*REQUIRED_FIELDS)  # 一次 C 调用取出全部必填值
+
+# 单类设备同时在途的会话上限（管理面较弱、并发登录易被限流的平台），未列出的只受 -t 约束
+DEVICE_CONCURRENCY: Dict[str, int] = {
+    'paloalto_panos': 8,
+}
 
 # 需要手写分页的 device_type（Netmiko send_command 不会自动应答 --More--）
 MANUAL_PAGER_TYPES = {'generic_termserver', 'terminal_server', 'generic'}
@@ -69,53 +151,107 @@ PAGER_RE = re.compile(
 ANSI_RE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')   # CSI 序列：\x1b[7m \x1b[K 等
 ANSI_OTHER_RE = re.compile(r'\x1b[()][AB0]')      # 字符集切换
 BACKSPACE_RE = re.compile(r'.\x08')               # 退格覆盖
+BLANK_LINES_RE = re.compile(r'\n{3,}')            # 3 行以上连续空行
+# 从提示符中提取主机名：R1#  <HUAWEI>  [H3C]  user@fw>  admin@fw(active)>  FGT (root) #
+HOSTNAME_RE = re.compile(r'\S*?([\w.\-]+)\s*(?:\([^)]*\))?\s*[#>$\]]')
+# Netmiko 的 base_prompt 已去掉结束符（R1、HUAWEI、admin@fw），取末尾的名字
+BASE_PROMPT_RE = re.compile(r'([\w.\-]+)\s*(?:\([^)]*\))?\s*$')
+# 文件名非法字符：固定字符集用 str.translate 删除，比正则替换快
+FILENAME_BAD_CHARS = str.maketrans('', '', '\\/*?:"<>|')
 
 
 # ---------------------------------------------------------------------------
 # 工具函数
 # ---------------------------------------------------------------------------
-def thread_initializer() -> None:
-    """线程初始化（解决编码问题）"""
-    import encodings.idna
-    encodings.idna.__name__
+_netmiko = None
+_supported_device_types: Optional[frozenset] = None
+
+
+def get_netmiko():
+    """延迟导入 netmiko，只导入一次"""
+    global _netmiko
+    if _netmiko is None:
+        import netmiko as _netmiko
+    return _netmiko
+
+
+def supported_device_types() -> frozenset:
+    """Netmiko 支持的全部 device_type"""
+    global _supported_device_types
+    if _supported_device_types is None:
+        from netmiko.ssh_dispatcher import CLASS_MAPPER
+        _supported_device_types = frozenset(CLASS_MAPPER)
+    return _supported_device_types
+
+
+def _init_sheet_worker(device_types: frozenset) -> None:
+    """解析子进程初始化：直接用主进程传来的 device_type 表，子进程不必导入 netmiko。"""
+    global _supported_device_types
+    _supported_device_types = device_types
+
+
+def list_supported_devices() -> None:
+    """按厂商分组打印支持的 device_type（仅 --list-devices 时分组，一趟完成）"""
+    by_vendor: Dict[str, List[str]] = {}
+    for dt in sorted(supported_device_types()):
+        by_vendor.setdefault(get_device_vendor(dt), []).append(dt)
+    for vendor in sorted(by_vendor):
+        print(f"{vendor}: {', '.join(by_vendor[vendor])}")
+    print(f"\n共 {len(by_vendor)} 个厂商，{sum(map(len, by_vendor.values()))} 种 device_type")
 
 
 def sanitize_filename(name: str) -> str:
     """生成安全文件名"""
-    return re.sub(r'[\\/*?:"<>|]', '', str(name)).strip()[:60]
+    return str(name).translate(FILENAME_BAD_CHARS).strip()[:60]
+
+
+def extract_hostname(prompt: str, host: str) -> str:
+    """从提示符提取主机名，提取不到时用 IP 代替。"""
+    m = HOSTNAME_RE.search(prompt)
+    return m.group(1) if m else sanitize_filename(host)
+
+
+def hostname_of(conn: netmiko.BaseConnection, host: str) -> str:
+    """主机名优先取 Netmiko 登录时已探测好的 base_prompt，拿不到才 find_prompt 多走一次往返。"""
+    if m := BASE_PROMPT_RE.search(getattr(conn, 'base_prompt', None) or ''):
+        return m.group(1)
+    return extract_hostname(conn.find_prompt().strip(), host)
 
 
 def log_error(host: str, msg: str) -> None:
     """统一错误日志（控制台 + error_log 文件）"""
-    line = f"[{datetime.datetime.now():%Y-%m-%d %H:%M:%S}] {host} {msg}"
+    line = f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {host} {msg}"  # 不构造 datetime 对象
     print(line)
-    with write_lock:
-        with open("error_log.txt", "a", encoding="utf-8") as f:
-            f.write(line + "\n")
+    error_logger.error(line)
 
 
+@functools.lru_cache(maxsize=256)
 def resolve_device_type(raw: Any) -> str:
-    """把别名或原始字符串解析为 Netmiko 标准 device_type。"""
+    """把别名或原始字符串解析为 Netmiko 标准 device_type。
+    清单里类型取值只有寥寥几种，按原始值缓存后每行只剩一次字典命中。"""
     if raw is None:
         return 'generic_termserver'
     key = str(raw).strip().lower()
     if not key:
         return 'generic_termserver'
-    if key in SUPPORTED_DEVICE_TYPES:
-        return key
+    if key in supported_device_types():
+        return sys.intern(key)  # 驻留后各处按 device_type 查表走字符串同一性快路径
     return DEVICE_TYPE_ALIASES.get(key, 'generic_termserver')
 
 
-def validate_device_data(device: Dict[str, str], row_idx: int) -> None:
-    """验证设备数据完整性"""
-    required = ['host', 'username', 'password', 'device_type']
-    if missing := [f for f in required if not device.get(f)]:
-        raise ValueError(f"Row {row_idx} 缺失字段: {', '.join(missing)}")
-
-
 # ---------------------------------------------------------------------------
 # 输出目录与保存
 # ---------------------------------------------------------------------------
+def get_fd_limit() -> Optional[int]:
+    """进程可打开的文件描述符上限（每个 SSH 会话占一个套接字）；Windows 无此限制返回 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
 def get_output_dir() -> str:
     """输出目录：result_当天日期，例如 result_20260624。"""
     out_dir = f"result_{datetime.datetime.now():%Y%m%d}"
@@ -123,79 +259,549 @@ def get_output_dir() -> str:
     return out_dir
 
 
-def save_result(device: Dict[str, str], content: str, out_dir: str) -> None:
-    """保存为 IP_主机名.txt。"""
+OUTPUT_FORMATS = ('txt', 'jsonl', 'zip')
+JSONL_FLUSH_EVERY = 100  # jsonl 模式每累计 N 条刷一次盘
+
+
+class ResultWriter:
+    """单个写线程顺序落盘结果，工作线程只负责入队，不用抢锁。
+    成功不逐台打印（进度由 tqdm 显示，结束时汇总输出目录），失败才记 log_error。
+
+    txt   每台设备一个 IP_主机名.txt（默认）
+    jsonl 全部设备追加到输出目录下的 results.jsonl，一行一台，
+          字段 ip / hostname / timestamp / output，省去 N 次建文件
+    zip   每次运行一个 results_时分秒.zip，成员仍为 IP_主机名.txt；
+          只建一个文件、目录区关闭时写一次（进程被强杀时归档不完整）
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread: Optional[Thread] = None
+        self.fmt = 'txt'
+        self.out_dir = '.'
+        self.atomic = False
+        self.written = 0  # 确认落盘的设备数，只由写线程自增
+
+    def start(self, out_dir: str, fmt: str = 'txt', atomic: bool = False) -> None:
+        self.out_dir, self.fmt, self.atomic = out_dir, fmt, atomic
+        self._thread = Thread(target=self._loop, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, host: str, hostname: str, path: str, content: List[str]) -> None:
+        self._queue.put((host, hostname, path, content))
+
+    def close(self) -> None:
+        """写完队列中剩余结果后退出写线程。"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self) -> None:
+        if self.fmt == 'jsonl':
+            self._loop_jsonl(os.path.join(self.out_dir, 'results.jsonl'))
+            return
+        if self.fmt == 'zip':
+            self._loop_zip(os.path.join(self.out_dir, f"results_{time.strftime('%H%M%S')}.zip"))
+            return
+        while (item := self._queue.get()) is not None:
+            host, _, path, content = item
+            try:
+                # 文件名按 (IP, 主机名) 唯一，默认直接覆盖写；--atomic 时先写临时文件再替换，
+                # 中途中断也不会留下半个结果文件
+                tmp = path + '.tmp' if self.atomic else path
+                with open(tmp, 'w', encoding='utf-8', buffering=1 << 16) as f:  # 大块缓冲，少写几次
+                    f.writelines(content)
+                if tmp != path:
+                    os.replace(tmp, path)
+            except (OSError, UnicodeError) as e:
+                log_error(host, f"文件保存失败: {e}")
+                continue
+            self.written += 1
+
+    def _fail_all(self, hosts: Iterable[str], err: Exception) -> None:
+        for host in hosts:
+            log_error(host, f"文件保存失败: {err}")
+
+    def _drain_failed(self, err: Exception) -> None:
+        """输出文件打不开：队列里的结果逐台记失败，照常取到结束标记，写线程不悄悄退出。"""
+        while (item := self._queue.get()) is not None:
+            self._fail_all((item[0],), err)
+
+    def _flush_jsonl(self, f: Any, hosts: List[str]) -> None:
+        """刷盘成功才把这一批计入 written"""
+        try:
+            f.flush()
+            self.written += len(hosts)
+        except OSError as e:
+            self._fail_all(hosts, e)
+        hosts.clear()
+
+    def _loop_jsonl(self, path: str) -> None:
+        try:
+            f = open(path, 'a', encoding='utf-8')
+        except OSError as e:
+            self._drain_failed(e)
+            return
+        pending: List[str] = []  # 已写入缓冲、尚未刷盘的设备
+        try:
+            while (item := self._queue.get()) is not None:
+                host, hostname, _, content = item
+                try:
+                    f.write(json.dumps({
+                        'ip': host,
+                        'hostname': hostname,
+                        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'output': ''.join(content),
+                    }, ensure_ascii=False) + '\n')
+                except (OSError, UnicodeError) as e:
+                    log_error(host, f"文件保存失败: {e}")
+                    continue
+                pending.append(host)
+                if len(pending) >= JSONL_FLUSH_EVERY:
+                    self._flush_jsonl(f, pending)
+            self._flush_jsonl(f, pending)
+        finally:
+            with contextlib.suppress(OSError):
+                f.close()
+
+    def _loop_zip(self, path: str) -> None:
+        # compresslevel=3：文本压缩率已足够，CPU 开销远低于默认的 6
+        try:
+            zf = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=3)
+        except OSError as e:
+            self._drain_failed(e)
+            return
+        members: List[str] = []  # 目录区写成功前成员都不算落盘
+        try:
+            while (item := self._queue.get()) is not None:
+                host, _, member, content = item
+                name = os.path.basename(member)
+                try:
+                    with zf.open(name, 'w') as f:  # 按片段流式压缩，不先 join 成整串
+                        for chunk in content:
+                            f.write(chunk.encode('utf-8'))
+                except (OSError, UnicodeError) as e:
+                    log_error(host, f"文件保存失败: {e}")
+                    continue
+                members.append(host)
+        finally:
+            try:
+                zf.close()
+                self.written += len(members)
+            except OSError as e:
+                self._fail_all(members, e)
+
+
+result_writer = ResultWriter()
+
+
+def save_result(device: Dict[str, str], content: List[str], out_dir: str) -> None:
+    """保存为 IP_主机名.txt 或 results.jsonl 的一行（交给写线程异步落盘）。"""
     host = sanitize_filename(device.get('host', 'unknown'))
     hostname = sanitize_filename(device.get('hostname', '') or 'nohost')
     path = os.path.join(out_dir, f"{host}_{hostname}.txt")
-    with write_lock:
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(content)
-    print(f"{device['host']} [OK] 已保存 -> {path}")
+    result_writer.put(device['host'], hostname, path, content)
 
 
 # ---------------------------------------------------------------------------
 # Excel 加载
 # ---------------------------------------------------------------------------
-def load_excel(excel_file: str, sheet_name: str = 'Sheet1') -> List[Dict[str, str]]:
+def _iter_rows_calamine(excel_file: str, sheet_name: str) -> Iterator[Sequence[Any]]:
+    """python-calamine（Rust 实现）整表解析，速度和内存都远优于 openpyxl。"""
+    wb = CalamineWorkbook.from_path(excel_file)
+    if sheet_name not in wb.sheet_names:
+        raise ValueError(f"工作表 '{sheet_name}' 不存在")
+    yield from wb.get_sheet_by_name(sheet_name).to_python()
+
+
+class _MappedFile(mmap.mmap):
+    """mmap 在 3.13 前缺 seekable()，zipfile 打开成员时要用"""
+    def seekable(self) -> bool:
+        return True
+
+
+@contextlib.contextmanager
+def _mapped_xlsx(excel_file: str) -> Iterator[mmap.mmap]:
+    """只读映射整个 xlsx：zip 目录与各部件的随机读直接命中页缓存，不再逐次 seek+read 系统调用。"""
+    with open(excel_file, 'rb') as f, _MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
+
+
+def _iter_rows_openpyxl(excel_file: str, sheet_name: str) -> Iterator[Sequence[Any]]:
+    """openpyxl 只读模式逐行读取。"""
+    import openpyxl
+    with _mapped_xlsx(excel_file) as mm:
+        wb = openpyxl.load_workbook(mm, read_only=True, data_only=True, keep_links=False)
+        try:
+            if sheet_name not in wb.sheetnames:
+                raise ValueError(f"工作表 '{sheet_name}' 不存在")
+            yield from wb[sheet_name].iter_rows(values_only=True)
+        finally:
+            wb.close()
+
+
+# xlsx 内部 XML 命名空间
+_XL_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_XL_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def _xlsx_sheet_path(zf: zipfile.ZipFile, sheet_name: str) -> str:
+    """workbook.xml 按表名查 r:id，再经 workbook.xml.rels 找到工作表 XML 路径。"""
+    rid = next((s.get(_XL_REL_NS + 'id')
+                for s in ET.fromstring(zf.read('xl/workbook.xml')).iter(_XL_NS + 'sheet')
+                if s.get('name') == sheet_name), None)
+    if rid is None:
+        raise ValueError(f"工作表 '{sheet_name}' 不存在")
+    for rel in ET.fromstring(zf.read('xl/_rels/workbook.xml.rels')).iter(_PKG_REL_NS + 'Relationship'):
+        if rel.get('Id') == rid:
+            target = rel.get('Target', '')
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+    raise ValueError(f"工作表 '{sheet_name}' 缺少关系定义")
+
+
+def _xlsx_shared_strings(zf: zipfile.ZipFile) -> List[str]:
+    """sharedStrings.xml 流式解析一次，供单元格按下标取值。"""
+    if 'xl/sharedStrings.xml' not in zf.NameToInfo:
+        return []
+    strings: List[str] = []
+    with zf.open('xl/sharedStrings.xml') as f:
+        for _, el in ET.iterparse(f):
+            if el.tag == _XL_NS + 'si':
+                t = el.find(_XL_NS + 't')  # 纯文本；否则是富文本 <r><t>，跳过注音 <rPh>
+                strings.append((t.text or '') if t is not None else
+                               ''.join(r.findtext(_XL_NS + 't') or '' for r in el.iter(_XL_NS + 'r')))
+                el.clear()
+    return strings
+
+
+def _xlsx_col(ref: str) -> int:
+    """单元格引用转 0 起列号：A1 -> 0，AB12 -> 27"""
+    n = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        n = n * 26 + ord(ch.upper()) - 64
+    return n - 1
+
+
+def _xlsx_cell(c: ET.Element, shared: List[str]) -> Any:
+    t = c.get('t')
+    if t == 'inlineStr':
+        return ''.join(x.text or '' for x in c.iter(_XL_NS + 't'))
+    v = c.findtext(_XL_NS + 'v')
+    if v is None:
+        return None
+    if t == 's':
+        return shared[int(v)]
+    if t == 'b':
+        return v == '1'
+    if t in ('str', 'e'):
+        return v
+    return float(v) if any(ch in v for ch in '.eE') else int(v)
+
+
+def _iter_rows_xml(excel_file: str, sheet_name: str) -> Iterator[Sequence[Any]]:
+    """标准库 zipfile + iterparse 直接流式解析工作表 XML：不建工作簿/单元格对象，
+    每行产出后即从树上摘除，内存占用不随行数增长。无需任何第三方库。"""
+    with _mapped_xlsx(excel_file) as mm, zipfile.ZipFile(mm) as zf:
+        shared = _xlsx_shared_strings(zf)
+        with zf.open(_xlsx_sheet_path(zf, sheet_name)) as f:
+            sheet_data = None
+            next_row = 1
+            width = 0  # 与 openpyxl/calamine 一致：行尾缺省的单元格补齐为空
+            for event, el in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if el.tag == _XL_NS + 'sheetData':
+                        sheet_data = el
+                    continue
+                if el.tag != _XL_NS + 'row':
+                    continue
+                # 省略的空行补成空元组，保持行号与 Excel 一致（报错提示用）
+                row_no = int(el.get('r') or next_row)
+                for _ in range(next_row, row_no):
+                    yield ()
+                next_row = row_no + 1
+                values: List[Any] = []
+                for c in el.iter(_XL_NS + 'c'):
+                    ref = c.get('r')
+                    if ref and (col := _xlsx_col(ref)) > len(values):
+                        values.extend([None] * (col - len(values)))  # 稀疏列补空
+                    values.append(_xlsx_cell(c, shared))
+                width = max(width, len(values))
+                values.extend([None] * (width - len(values)))
+                yield tuple(values)
+                el.clear()
+                if sheet_data is not None:
+                    sheet_data.remove(el)
+
+
+EXCEL_ENGINES = {
+    'calamine': _iter_rows_calamine,
+    'openpyxl': _iter_rows_openpyxl,
+    'xml': _iter_rows_xml,
+}
+
+
+def _cell_str(cell: Any) -> str:
+    """单元格转字符串；calamine 把整数读成 float，还原成 15 而不是 15.0。"""
+    if type(cell) is str:  # 绝大多数单元格是文本，直接 strip，省一次 str() 调用
+        return cell.strip()
+    if cell is None:
+        return ""
+    if isinstance(cell, float) and cell.is_integer():
+        cell = int(cell)
+    return str(cell).strip()
+
+
+def split_commands(raw: str) -> List[str]:
+    """按 ; 拆分命令并去掉空项"""
+    return [c.strip() for c in raw.split(';') if c.strip()]
+
+
+def load_excel(
+    excel_file: str,
+    sheet_name: str = 'Sheet1',
+    engine: str = 'calamine',
+) -> List[Dict[str, str]]:
     """加载Excel设备清单"""
+    if engine == 'calamine' and CalamineWorkbook is None:
+        engine = 'xml'  # 未安装 python-calamine 时回退到标准库流式解析
     devices: List[Dict[str, str]] = []
-    wb = None
     try:
-        wb = openpyxl.load_workbook(excel_file, read_only=True)
-        if sheet_name not in wb.sheetnames:
-            raise ValueError(f"工作表 '{sheet_name}' 不存在")
-        sheet = wb[sheet_name]
-
-        headers = [str(cell.value).lower().strip() for cell in sheet[1]]
-        required = ['host', 'username', 'password', 'device_type']
-        if missing := [f for f in required if f not in headers]:
+        rows = EXCEL_ENGINES[engine](excel_file, sheet_name)
+        if (header_row := next(rows, None)) is None:
+            raise ValueError(f"工作表 '{sheet_name}' 为空")
+        headers = [_cell_str(h).lower() for h in header_row]
+        header_set = frozenset(headers)
+        if missing := [f for f in REQUIRED_FIELDS if f not in header_set]:
             raise ValueError(f"缺少必要列: {', '.join(missing)}")
 
-        for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), 2):
-            device = {
-                headers[i]: (str(cell).strip() if cell is not None else "")
-                for i, cell in enumerate(row)
-            }
+        # 清洗、建字典、校验在同一趟内完成，不再二次遍历字段
+        for row_idx, row in enumerate(rows, 2):
+            device = dict(zip(headers, map(_cell_str, row)))
             if not any(device.values()):
                 continue  # 跳过整行空白
-            # 别名解析为标准 device_type
-            device['device_type'] = resolve_device_type(device.get('device_type'))
-            validate_device_data(device, row_idx)
+            # 别名解析为标准 device_type；原值留给报错提示，厂商名加载时一并算好
+            device['original_type'] = device['device_type']
+            device['device_type'] = resolve_device_type(device['device_type'])
+            device['_vendor'] = get_device_vendor(device['device_type'])
+            if not all(_required_values(device)):  # 数据干净时只走这一次判断，出错才逐列列出缺失项
+                missing = [f for f in REQUIRED_FIELDS if not device[f]]
+                raise ValueError(f"Row {row_idx} 缺失字段: {', '.join(missing)}")
+            # 命令拆分与超时换算在加载时做一次，工作线程直接取用
+            device['_cmds'] = split_commands(device.get('mult_command', ''))
+            try:
+                device['_read_timeout'] = int(device.get('readtime') or 0)  # 0 表示未填，按连接档位取默认
+            except ValueError:
+                raise ValueError(
+                    f"工作表 '{sheet_name}' Row {row_idx} readtime 不是整数: {device['readtime']}"
+                ) from None
             devices.append(device)
 
         return devices
     except Exception as e:
         print(f"Excel处理失败: {e}")
         sys.exit(1)
-    finally:
-        if wb:
-            wb.close()
+
+
+def load_sheets(excel_file: str, sheet_names: List[str], engine: str = 'calamine') -> List[Dict[str, str]]:
+    """加载一个或多个工作表；多个工作表时每个表交给独立进程解析（XML 解析是
+    CPU 密集型，线程受 GIL 限制），解析完再合并交给线程池执行 SSH。"""
+    if len(sheet_names) == 1:
+        return load_excel(excel_file, sheet_names[0], engine)
+    workers = min(len(sheet_names), effective_cpu_count())
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_sheet_worker, initargs=(supported_device_types(),),
+    ) as pp:
+        shards = pp.map(load_excel, repeat(excel_file), sheet_names, repeat(engine))
+        return [dev for shard in shards for dev in shard]
+
+
+# 解析结果缓存目录；缓存内含设备密码，仅在 --excel-cache 时启用，文件权限 0600
+EXCEL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'netdev_dep')
+EXCEL_CACHE_VERSION = 4  # 设备字典字段有变化时递增，旧缓存自动失效
+
+
+def load_sheets_cached(excel_file: str, sheet_names: List[str], engine: str = 'calamine') -> List[Dict[str, str]]:
+    """按 (绝对路径, mtime, 大小, 工作表, 引擎) 缓存解析结果，文件未变时跳过整表解析。"""
+    st = os.stat(excel_file)
+    key = (EXCEL_CACHE_VERSION, os.path.abspath(excel_file), st.st_mtime_ns, st.st_size,
+           tuple(sheet_names), engine)
+    cache_file = os.path.join(EXCEL_CACHE_DIR, hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    devices = load_sheets(excel_file, sheet_names, engine)
+    try:
+        os.makedirs(EXCEL_CACHE_DIR, mode=0o700, exist_ok=True)
+        # 先写临时文件再原子替换，并发运行或中途退出都不会留下半个缓存
+        with tempfile.NamedTemporaryFile('wb', dir=EXCEL_CACHE_DIR, delete=False) as tmp:
+            pickle.dump(devices, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp.name, 0o600)
+        os.replace(tmp.name, cache_file)
+    except OSError as e:
+        print(f"[WARN] Excel 缓存写入失败: {e}")
+    return devices
 
 
 # ---------------------------------------------------------------------------
 # 设备连接
 # ---------------------------------------------------------------------------
+# 连接参数：默认走快速档（fast_cli 开启、延迟系数 0.1），
+# --compat、Excel fast_cli 列为 0 或 Telnet 设备改用保守档（fast_cli 关闭、延迟系数 1，超时放宽）
+class ConnectProfile(NamedTuple):
+    """连接参数档位（不可变，字段名即 ConnectHandler 参数名）"""
+    timeout: int
+    banner_timeout: int
+    auth_timeout: int
+    conn_timeout: int
+    session_timeout: int
+    fast_cli: bool
+    global_delay_factor: float
+    use_keys: Optional[bool] = None  # None 表示沿用 Netmiko 默认
+    allow_agent: Optional[bool] = None
+
+
+FAST_CONNECT_CONFIG = ConnectProfile(
+    timeout=20, banner_timeout=15, auth_timeout=15, conn_timeout=10,
+    session_timeout=60, fast_cli=True, global_delay_factor=0.1,
+)
+COMPAT_CONNECT_CONFIG = ConnectProfile(
+    timeout=60, banner_timeout=30, auth_timeout=30, conn_timeout=20,
+    session_timeout=120, fast_cli=False, global_delay_factor=1,
+)
+SSH_ONLY_FIELDS = ('use_keys', 'allow_agent')
+COMPAT_MODE = False  # 由 main 按 --compat 设置，工作线程启动前确定
+handshake_slots: Optional[threading.BoundedSemaphore] = None  # 由 main 按 --connect-threads 设置
+# 调试日志文件名后缀：进程号 + 自增序号（next() 在 GIL 下原子），
+# 同一次运行内唯一，无需读随机数
+_DEBUG_LOG_PREFIX = f"{os.getpid():x}-"
+_debug_log_seq = count()
+
+
+def get_device_config(device_type: str, compat: bool) -> ConnectProfile:
+    """按 device_type 与是否兼容模式选取连接参数档位"""
+    if compat or device_type.endswith('_telnet'):
+        return COMPAT_CONNECT_CONFIG
+    return FAST_CONNECT_CONFIG
+
+
+@functools.lru_cache(maxsize=64)
+def get_device_vendor(device_type: str) -> str:
+    """device_type 前缀即厂商名，如 cisco_ios -> cisco（按类型缓存，同类设备只切分一次）"""
+    return device_type.split('_', 1)[0]
+
+
+def post_connection_setup(
+    conn: netmiko.BaseConnection, device_type: str, vendor: str, secret: Optional[str],
+) -> None:
+    """登录后处理：填写了 secret 时进入 enable。分页关闭已由 Netmiko 会话准备完成，这里不再补发命令。
+    enable() 自己会先 check_enable_mode()，外面再查一遍等于多一次提示符往返"""
+    if secret:
+        conn.enable()
+
+
+@functools.lru_cache(maxsize=64)
+def base_connect_params(device_type: str, compat: bool) -> Dict[str, Any]:
+    """只与 device_type/档位有关的固定连接参数，每种组合只构建一次（调用方复制后再补设备字段）"""
+    params: Dict[str, Any] = {'device_type': device_type, **get_device_config(device_type, compat)._asdict()}
+    # **厂商特定配置**：未设置的不传；Telnet 连接不需要 SSH 相关参数
+    telnet = device_type.endswith('_telnet')
+    for key in SSH_ONLY_FIELDS:
+        if telnet or params[key] is None:
+            del params[key]
+    return params
+
+
+def device_base_params(device: Dict[str, str]) -> Dict[str, Any]:
+    """单台设备的固定连接参数：Excel fast_cli 列填 0 时单台改用保守档，其余设备仍走快速档"""
+    return base_connect_params(device['device_type'], COMPAT_MODE or str(device.get('fast_cli') or '1') == '0')
+
+
+def effective_read_timeout(device: Dict[str, str]) -> int:
+    """readtime 列留空（0）时按连接档位取默认，与建连时的 read_timeout_override 一致"""
+    return device['_read_timeout'] or device_base_params(device)['timeout']
+
+
+# 握手前的 TCP 端口探测超时（秒）：端口不通的设备几秒内判死，不再等 banner 超时并重试；0 关闭探测
+PORT_PROBE_TIMEOUT = float(os.environ.get("MDEV_PORT_PROBE_TIMEOUT", "2"))
+PORT_PROBE_ATTEMPTS = 2  # 偶发丢包不至于直接跳过设备：连探两次都不通才判定不可达
+
+
+def port_reachable(host: str, port: int, timeout: float) -> bool:
+    """TCP 连一下目标端口，连上立即关闭。"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+# 主机名预解析：派发前在主线程并发解析一次，端口探测与 paramiko 握手直接用地址，
+# 不再连接一次就在工作线程里各走一遍 getaddrinfo
+resolved_hosts: Dict[str, str] = {}
+
+
+def _is_ip_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def prefetch_dns(devices: List[Dict[str, str]], workers: int) -> int:
+    """并发解析清单中的主机名（IP 与串口设备跳过），写入 resolved_hosts，返回解析成功数。
+    解析失败的保持原样，连接阶段照常报错。"""
+    names = {d['host'] for d in devices
+             if not d['device_type'].endswith('_serial') and not _is_ip_literal(d['host'])}
+    if not names:
+        return 0
+
+    def resolve(host: str) -> Tuple[str, Optional[str]]:
+        try:
+            return host, socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0][4][0]
+        except (OSError, UnicodeError):
+            return host, None
+
+    with ThreadPoolExecutor(max_workers=min(len(names), workers, 64), thread_name_prefix='mdev-dns') as ex:
+        resolved_hosts.update((h, addr) for h, addr in ex.map(resolve, names) if addr)
+    return len(resolved_hosts)
+
+
+def retry_delay(attempt: int) -> float:
+    """指数退避加随机抖动（0.5~1.5 倍）：同一波网络抖动里失败的设备错开重连，不在同一时刻扎堆握手"""
+    return (2 ** attempt) * (0.5 + random.random())
+
+
+@functools.lru_cache(maxsize=None)
+def debug_log_dir() -> str:
+    """调试日志目录按本次运行的日期取一次、建一次"""
+    path = os.path.join("debug_logs", time.strftime('%Y%m%d'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
 def connect_device(device: Dict[str, str]) -> Optional[netmiko.BaseConnection]:
     """**通用设备连接（支持所有netmiko设备）**"""
     device_type = device['device_type']
-    device_config = get_device_config(device_type)
-    vendor = get_device_vendor(device_type)
-    
-    # **基础连接参数**
+    vendor = device['_vendor']
+    base = device_base_params(device)
+    addr = resolved_hosts.get(device['host'], device['host'])  # 日志、文件名仍用原 host
+
+    # **基础连接参数**：固定部分查缓存，只补设备相关字段
     params = {
-        'device_type': device_type,
-        'host': device['host'],
+        **base,
+        'host': addr,
         'username': device['username'],
         'password': device['password'],
-        'timeout': device_config['timeout'],
-        'banner_timeout': device_config['banner_timeout'],
-        'auth_timeout': device_config['auth_timeout'],
-        'fast_cli': device_config['fast_cli'],
-        'session_timeout': device_config['session_timeout'],
-        'global_delay_factor': device_config['global_delay_factor'],
-        'conn_timeout': device_config['conn_timeout'],
-        'read_timeout_override': int(device.get('readtime', device_config['timeout']))
+        # Netmiko 的 override 优先于各次读取传入的 read_timeout；用合并后的超时，readtime 列留空时按档位
+        'read_timeout_override': device['_read_timeout'] or base['timeout'],
     }
 
     # **可选参数**
@@ -203,57 +809,74 @@ def connect_device(device: Dict[str, str]) -> Optional[netmiko.BaseConnection]:
         params['secret'] = device['secret']
     if device.get('port'):
         params['port'] = int(device['port'])
-    
-    # **厂商特定配置**
-    if 'use_keys' in device_config:
-        params['use_keys'] = device_config['use_keys']
-    if 'allow_agent' in device_config:
-        params['allow_agent'] = device_config['allow_agent']
-
-    # **特殊协议配置**
-    if device_type.endswith('_telnet'):
-        # Telnet连接不需要SSH相关参数
-        params.pop('use_keys', None)
-        params.pop('allow_agent', None)
-    elif device_type.endswith('_serial'):
-        # 串口连接特殊配置
-        if device.get('serial_settings'):
-            params['serial_settings'] = device['serial_settings']
+
+    # **特殊协议配置**：串口连接
+    if device_type.endswith('_serial') and device.get('serial_settings'):
+        params['serial_settings'] = device['serial_settings']
 
     # **调试日志配置**
     if device.get('debug'):
-        debug_dir = os.path.join("debug_logs", datetime.datetime.now().strftime('%Y%m%d'))
-        os.makedirs(debug_dir, exist_ok=True)
-        log_file = f"{sanitize_filename(device['host'])}_{uuid.uuid4().hex[:6]}.log"
-        params['session_log'] = os.path.join(debug_dir, log_file)
+        log_file = f"{sanitize_filename(device['host'])}_{_DEBUG_LOG_PREFIX}{next(_debug_log_seq):03x}.log"
+        params['session_log'] = os.path.join(debug_log_dir(), log_file)
+
+    # **端口预检**：连探 PORT_PROBE_ATTEMPTS 次都不通才放弃，不进入握手重试
+    if PORT_PROBE_TIMEOUT > 0 and not device_type.endswith('_serial'):
+        port = params.get('port') or (23 if device_type.endswith('_telnet') else 22)
+        if not any(port_reachable(addr, port, PORT_PROBE_TIMEOUT) for _ in range(PORT_PROBE_ATTEMPTS)):
+            log_error(device['host'], f"[SKIP] 端口 {port} 连续 {PORT_PROBE_ATTEMPTS} 次探测不可达")
+            return None
 
     # **多重连接尝试**
+    nm = get_netmiko()
     max_retries = 2
     for attempt in range(max_retries + 1):
         try:
-            conn = netmiko.ConnectHandler(**params)
+            with handshake_slots or contextlib.nullcontext():
+                conn = nm.ConnectHandler(**params)
             
             # **设备特定的后连接处理**
             post_connection_setup(conn, device_type, vendor, device.get('secret'))
             
             return conn
             
-        except (NetmikoTimeoutException, NetmikoAuthenticationException) as e:
+        except nm.NetmikoAuthenticationException as e:
+            # 认证失败是确定性的，重试只会多占线程、多触发设备的登录失败计数
+            log_error(device['host'], f"{e.__class__.__name__}: {str(e)} (Type: {device['original_type']})")
+            return None
+        except nm.NetmikoTimeoutException as e:
             if attempt < max_retries:
                 print(f"[RETRY {attempt+1}] {device['host']}: {e.__class__.__name__}")
-                time.sleep(2 ** attempt)
+                time.sleep(retry_delay(attempt))
                 continue
-            log_error(device['host'], f"{e.__class__.__name__}: {str(e)} (Type: {device.get('original_type', device_type)})")
+            log_error(device['host'], f"{e.__class__.__name__}: {str(e)} (Type: {device['original_type']})")
         except Exception as e:
             if attempt < max_retries:
                 print(f"[RETRY {attempt+1}] {device['host']}: Connection error")
-                time.sleep(2 ** attempt)
+                time.sleep(retry_delay(attempt))
                 continue
-            log_error(device['host'], f"连接异常: {str(e)} (Type: {device.get('original_type', device_type)})")
+            log_error(device['host'], f"连接异常: {str(e)} (Type: {device['original_type']})")
     
     return None
 
 
+# ---------------------------------------------------------------------------
+# 同一设备只建一个会话
+# ---------------------------------------------------------------------------
+# 同一设备的多行由 coalesce_devices 合并成一台，一次运行里每个会话只用一次、用完即断开，
+# 不设进程内连接池（池子永远命中不了，只会把空闲会话攒到批次结束）。
+# 注：Netmiko 基于 paramiko 自行实现 SSH，不经过 OpenSSH 客户端，无法使用
+# ControlMaster/ControlPersist 复用套接字。
+# （ControlPath 套接字可被同机其他用户劫持，本就不宜在共享跳板机上开启。）
+def device_key(device: Dict[str, str]) -> tuple:
+    """同一设备的判定键：(host, port, username, device_type)"""
+    return (
+        device['host'],
+        str(device.get('port') or 22),
+        device['username'],
+        device['device_type'],
+    )
+
+
 # ---------------------------------------------------------------------------
 # 终端服务器手写分页
 # ---------------------------------------------------------------------------
@@ -284,7 +907,7 @@ def clean_pager_output(raw: str) -> str:
     text = '\n'.join(cleaned)
 
     # 5. 压缩 3 行以上连续空行
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = BLANK_LINES_RE.sub('\n\n', text)
     return text.strip('\n')
 
 
@@ -351,127 +974,332 @@ def send_command_termserver(
     return clean_pager_output(''.join(output))
 
 
+# ---------------------------------------------------------------------------
+# 命令流水线：一次写入全部命令，省去 N-1 次提示符往返
+# ---------------------------------------------------------------------------
+def send_command_pipelined(
+    conn: netmiko.BaseConnection,
+    cmds: List[str],
+    prompt: str,
+    read_timeout: float,
+) -> List[str]:
+    """把全部命令一次写入通道，再逐个读到提示符：第 i 个提示符之前就是第 i 条命令的输出。
+    每次读取单独计时（与逐条 send_command 一样受 readtime 约束，不是整批共用一个 readtime）；
+    只按提示符计数、不匹配命令文本，前一条命令以后一条为前缀时也不会提前截断。
+    Netmiko 读到提示符后把多读的部分留在缓冲区，下一次读取接着用。"""
+    conn.write_channel(conn.RETURN.join(cmds) + conn.RETURN)
+    pattern = re.escape(prompt)
+    outs = []
+    for _ in cmds:
+        out = conn.read_until_pattern(pattern=pattern, read_timeout=read_timeout)
+        outs.append(out[:-len(prompt)].replace('\r\n', '\n'))  # 去掉结尾的提示符
+    return outs
+
+
 # ---------------------------------------------------------------------------
 # 命令执行（三条互斥分支）
 # ---------------------------------------------------------------------------
+ShowRunner = Callable[['netmiko.BaseConnection', Dict[str, str], List[str], int], List[str]]
+
+
+def output_chunks(pairs: Iterable[Tuple[str, str]]) -> List[str]:
+    """(命令, 输出) 展开为按序写盘的片段列表：写线程 writelines 直接落盘，
+    不再把整台设备的输出 join 成一个大字符串（大 show run 时峰值内存减半）"""
+    chunks: List[str] = []
+    for cmd, out in pairs:
+        if chunks:
+            chunks.append('\n')
+        chunks += (f"=== {cmd} ===\n", out.strip(), '\n')
+    return chunks
+
+
+def _run_send_command(
+    conn: netmiko.BaseConnection,
+    device: Dict[str, str],
+    cmds: List[str],
+    read_timeout: int,
+) -> List[str]:
+    """Netmiko send_command 逐条执行（自动处理分页）。"""
+    return output_chunks((cmd, conn.send_command(
+        cmd,
+        read_timeout=read_timeout,
+        strip_prompt=False,
+        strip_command=False,
+    )) for cmd in cmds)
+
+
+def _run_termserver(
+    conn: netmiko.BaseConnection,
+    device: Dict[str, str],
+    cmds: List[str],
+    read_timeout: int,
+) -> List[str]:
+    """终端服务器/generic：逐条执行并手动应答分页。"""
+    return output_chunks((cmd, send_command_termserver(conn, cmd)) for cmd in cmds)
+
+
+def _run_pipelined(
+    conn: netmiko.BaseConnection,
+    device: Dict[str, str],
+    cmds: List[str],
+    read_timeout: int,
+) -> List[str]:
+    """整批写入命令（Excel pipeline 列填 0 可关闭，回退逐条执行）。"""
+    if len(cmds) < 2 or str(device.get('pipeline') or '1') == '0':
+        return _run_send_command(conn, device, cmds, read_timeout)
+    prompt = conn.find_prompt().strip()  # 只有按提示符切分时才需要完整提示符
+    return output_chunks(zip(cmds, send_command_pipelined(conn, cmds, prompt, read_timeout)))
+
+
+# show 类命令按 device_type 查表选执行方式，未列出的走 send_command
+SHOW_RUNNERS: Dict[str, ShowRunner] = {
+    **{dt: _run_termserver for dt in MANUAL_PAGER_TYPES},
+    **{dt: _run_pipelined for dt in PIPELINE_TYPES},
+}
+
+
 def run_commands_on_conn(
     conn: netmiko.BaseConnection,
     device: Dict[str, str],
     cmds: List[str],
     config_set: bool,
-) -> str:
-    """按三条互斥分支执行命令并返回拼接后的输出。"""
-    dtype = device['device_type']
+) -> List[str]:
+    """按三条互斥分支执行命令，返回按序写盘的输出片段。"""
+    read_timeout = device['_read_timeout'] or 20
 
     # ---- 分支一：配置模式（send_config_set，不分页）----
     if config_set:
+        # 整批一次下发：进/出配置模式各一次往返，cmd_verify=False 不再逐条等待命令回显
         out = conn.send_config_set(
             cmds,
-            read_timeout=int(device.get('readtime', 20)),
+            read_timeout=read_timeout,
+            cmd_verify=False,
+            enter_config_mode=True,
+            exit_config_mode=True,
         )
         # 如需保存配置，按需打开：
         # out += '\n' + conn.save_config()
-        return out.strip() + '\n'
-
-    # ---- 分支二/三：show 类命令，逐条执行 ----
-    use_manual_pager = dtype in MANUAL_PAGER_TYPES
-    blocks = []
-    for cmd in cmds:
-        if use_manual_pager:
-            out = send_command_termserver(conn, cmd)
-        else:
-            out = conn.send_command(
-                cmd,
-                read_timeout=int(device.get('readtime', 20)),
-                strip_prompt=False,
-                strip_command=False,
-            )
-        blocks.append(f"=== {cmd} ===\n{out.strip()}\n")
-    return '\n'.join(blocks)
+        return [out.strip(), '\n']
+
+    # ---- 分支二/三：show 类命令，按平台查表分派 ----
+    runner = SHOW_RUNNERS.get(device['device_type'], _run_send_command)
+    return runner(conn, device, cmds, read_timeout)
 
 
 def execute_commands(
     device: Dict[str, str],
     config_set: bool,
-    cli_cmd: str,
+    cli_cmds: List[str],
     out_dir: str,
-) -> Optional[str]:
-    """连接设备、执行命令、保存结果。"""
+) -> bool:
+    """连接设备、执行命令、保存结果，返回是否成功。输出交给写线程后即释放，不随 Future 保留。"""
     # 行内命令优先，留空才回退到命令行 -c
-    raw_cmd = device.get('mult_command') or cli_cmd or ''
-    cmds = [c.strip() for c in raw_cmd.split(';') if c.strip()]
+    cmds = device['_cmds'] or cli_cmds
     if not cmds:
         print(f"{device['host']} [WARN] 无有效命令，跳过")
-        return None
+        return False
 
     if not (conn := connect_device(device)):
-        return None
+        return False
 
     try:
         with conn:
-            prompt = conn.find_prompt().strip()
-            m = re.search(r'\S*?([\w.\-]+)\s*[#>$\]]', prompt)
-            device['hostname'] = m.group(1) if m else sanitize_filename(device['host'])
+            device['hostname'] = hostname_of(conn, device['host'])
             output = run_commands_on_conn(conn, device, cmds, config_set)
-
         save_result(device, output, out_dir)
-        return output
+        return True
     except Exception as e:
         log_error(device['host'], f"执行异常: {e}")
-        return None
+        return False
 
 
 # ---------------------------------------------------------------------------
 # 主流程
 # ---------------------------------------------------------------------------
 def parse_args() -> argparse.Namespace:
-    p = argparse.ArgumentParser(description="批量网络设备命令执行工具")
-    p.add_argument('-i', '--input', required=True, help="Excel 设备清单文件")
-    p.add_argument('-s', '--sheet', default='Sheet1', help="工作表名（默认 Sheet1）")
+    p = argparse.ArgumentParser(
+        description="批量网络设备命令执行工具",
+        epilog=f"环境变量：MDEV_MAX_THREADS 为 -t 上限（当前 {MAX_THREADS}）；"
+               f"MDEV_PORT_PROBE_TIMEOUT 为握手前端口探测超时秒数（当前 {PORT_PROBE_TIMEOUT:g}，0 关闭），"
+               f"连续 {PORT_PROBE_ATTEMPTS} 次探测不通的设备直接跳过，不再进入连接重试",
+    )
+    p.add_argument('-i', '--input', help="Excel 设备清单文件（必填，--list-devices 时可省略）")
+    p.add_argument('-s', '--sheet', default='Sheet1',
+                   help="工作表名（默认 Sheet1），多个用逗号分隔，各表并行解析后合并")
+    p.add_argument('--excel-engine', choices=sorted(EXCEL_ENGINES), default='calamine',
+                   help="Excel 解析引擎（默认 calamine，未安装 python-calamine 时自动回退 xml；"
+                        "xml 为标准库流式解析，openpyxl 为旧版解析方式）")
+    p.add_argument('--excel-cache', action='store_true',
+                   help=f"缓存解析结果到 {EXCEL_CACHE_DIR}，文件未修改时直接复用（缓存含密码）")
     p.add_argument('-c', '--command', default='',
                    help="全局命令兜底（Excel 行内 mult_command 为空时使用），多条用 ; 分隔")
     p.add_argument('--config_set', action='store_true',
                    help="配置模式：使用 send_config_set 下发配置命令")
+    p.add_argument('-o', '--output-format', choices=OUTPUT_FORMATS, default='txt',
+                   help="结果格式：txt 每台一个文件（默认）；jsonl 全部写入 results.jsonl；"
+                        "zip 全部打包进本次运行的 results_时分秒.zip")
+    p.add_argument('--compat', action='store_true',
+                   help="兼容模式：关闭 fast_cli 并放宽延迟/超时，适用于老旧 IOS 或响应慢的设备")
+    p.add_argument('--connect-threads', type=int, default=DEFAULT_CONNECT_THREADS,
+                   help=f"同时进行 SSH 握手的上限（默认 {DEFAULT_CONNECT_THREADS}，0 表示不限），"
+                        "与 -t 会话并发分开控制")
+    p.add_argument('--atomic', action='store_true',
+                   help="txt 结果先写临时文件再原子替换（默认直接写入）")
     p.add_argument('-t', '--threads', type=int, default=DEFAULT_THREADS,
-                   help=f"并发线程数（默认 {DEFAULT_THREADS}）")
-    return p.parse_args()
+                   help=f"最大并发线程数（默认 {DEFAULT_THREADS}，实际取 min(设备数, 该值)）")
+    p.add_argument('--list-devices', action='store_true', help="按厂商列出支持的 device_type 后退出")
+    args = p.parse_args()
+    if not args.input and not args.list_devices:
+        p.error("缺少参数 -i/--input")
+    return args
+
+
+# 合并后的会话沿用首行的这些列；后续行取值不同时提示
+COALESCE_SESSION_FIELDS = ('password', 'secret', 'fast_cli', 'debug', 'serial_settings')
+
+
+def coalesce_devices(devices: List[Dict[str, str]], cli_cmds: List[str]) -> List[Dict[str, str]]:
+    """同一设备（host/port/username/device_type 相同）的多行合并为一台，
+    命令按行序拼接，只建一次 SSH 会话，结果也不会互相覆盖。
+    读超时取各行生效值（留空按档位默认）中的最大者；会话参数沿用首行。"""
+    grouped: Dict[tuple, Dict[str, str]] = {}
+    for dev in devices:
+        key = device_key(dev)
+        cmds = dev['_cmds'] or cli_cmds  # 各行先按自身规则回退 -c，再合并
+        if (first := grouped.get(key)) is None:
+            grouped[key] = {**dev, '_cmds': list(cmds)}
+            continue
+        first['_cmds'].extend(cmds)
+        first['_read_timeout'] = max(effective_read_timeout(first), effective_read_timeout(dev))
+        if diff := [f for f in COALESCE_SESSION_FIELDS if first.get(f, '') != dev.get(f, '')]:
+            print(f"[WARN] {dev['host']} 重复行的 {', '.join(diff)} 与首行不同，合并后按首行执行")
+    return list(grouped.values())
+
+
+def batch_execute(
+    devices: List[Dict[str, str]],
+    config_set: bool,
+    cli_cmds: List[str],
+    out_dir: str,
+    workers: int,
+) -> int:
+    """有界提交：在途任务不超过 workers*2，设备再多也不会一次性堆积全部 Future。
+    按 device_type 分组顺序提交，同类驱动集中执行；
+    DEVICE_CONCURRENCY 列出的类型另受单类并发上限约束：名额在提交前取，
+    取不到的设备先挂起、不占工作线程，其它类型照常提交，有名额空出再补交。
+    返回命令执行成功的台数（结果是否落盘以 result_writer.written 为准）。"""
+    inflight = threading.BoundedSemaphore(workers * 2)
+    type_slots = {dt: threading.BoundedSemaphore(n) for dt, n in DEVICE_CONCURRENCY.items() if n < workers}
+    parked: Dict[str, Deque[Dict[str, str]]] = {dt: deque() for dt in type_slots}
+    slot_freed = threading.Event()
+
+    successes = count()  # next() 在 CPython 下原子自增，回调线程直接计数无需加锁
+    from tqdm import tqdm
+    # 回调在工作线程里 update：合并刷新（至少隔 0.2s 或每 0.5% 重绘一次），少抢 tqdm 锁、少写终端
+    progress = tqdm(total=len(devices), desc="执行进度", unit="台",
+                    mininterval=0.2, miniters=max(1, len(devices) // 200), smoothing=0.1)
+
+    def on_done(fut: Future, dev: Dict[str, str]) -> None:
+        try:
+            if fut.result():
+                next(successes)
+        except Exception as e:
+            log_error(dev.get('host', '?'), f"线程异常: {e}")
+        finally:
+            inflight.release()
+            if (slot := type_slots.get(dev['device_type'])) is not None:
+                slot.release()
+                slot_freed.set()
+            progress.update(1)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mdev') as executor:
+            def submit(dev: Dict[str, str]) -> None:
+                inflight.acquire()  # 在途已满时阻塞，等有任务完成再提交
+                fut = executor.submit(execute_commands, dev, config_set, cli_cmds, out_dir)
+                fut.add_done_callback(lambda f, d=dev: on_done(f, d))
+
+            def submit_parked() -> None:
+                """挂起的设备按原顺序补交，直到该类型名额再次用满"""
+                for dt, waiting in parked.items():
+                    while waiting and type_slots[dt].acquire(blocking=False):
+                        submit(waiting.popleft())
+
+            for dev in sorted(devices, key=lambda d: d['device_type']):  # 稳定排序，同类内保持 Excel 行序
+                dt = dev['device_type']
+                if dt in type_slots and (parked[dt] or not type_slots[dt].acquire(blocking=False)):
+                    parked[dt].append(dev)
+                else:
+                    submit(dev)
+                submit_parked()
+            # 其它类型已全部提交，剩下的受限设备等名额空出再补交
+            while any(parked.values()):
+                slot_freed.clear()
+                submit_parked()
+                if any(parked.values()):
+                    slot_freed.wait()
+    finally:
+        progress.close()
+    return next(successes)
 
 
 def main() -> None:
+    global COMPAT_MODE, handshake_slots
     args = parse_args()
+    if args.list_devices:
+        list_supported_devices()
+        return
+    COMPAT_MODE = args.compat
+    _error_log_listener.start()
+    atexit.register(_error_log_listener.stop)
 
     if not os.path.isfile(args.input):
         print(f"找不到输入文件: {args.input}")
         sys.exit(1)
 
-    devices = load_excel(args.input, args.sheet)
+    sheets = [name.strip() for name in args.sheet.split(',') if name.strip()]
+    loader = load_sheets_cached if args.excel_cache else load_sheets
+    devices = loader(args.input, sheets, args.excel_engine)
     if not devices:
         print("没有可执行的设备。")
         sys.exit(0)
 
+    cli_cmds = split_commands(args.command)
+    if len(merged := coalesce_devices(devices, cli_cmds)) < len(devices):
+        print(f"合并重复设备: {len(devices)} 行 -> {len(merged)} 台")
+        devices = merged
+
+    if args.threads > MAX_THREADS:
+        print(f"[WARN] -t {args.threads} 超过上限，按 {MAX_THREADS} 执行（MDEV_MAX_THREADS 可调整）")
+    workers = min(len(devices), max(1, args.threads), MAX_THREADS)
+    if (fd_limit := get_fd_limit()) is not None:
+        # 每路并发至少占一个套接字，另留余量给日志/结果文件与 Python 自身
+        workers = max(1, min(workers, fd_limit // 4))
+    connect_limit = min(workers, args.connect_threads) if args.connect_threads > 0 else workers
+    if connect_limit < workers:
+        handshake_slots = threading.BoundedSemaphore(connect_limit)
     out_dir = get_output_dir()
     mode = "配置模式 (send_config_set)" if args.config_set else "命令模式 (send_command)"
-    print(f"共 {len(devices)} 台设备，{mode}，输出目录: {out_dir}")
-
-    ok = 0
-    with ThreadPoolExecutor(
-        max_workers=args.threads,
-        initializer=thread_initializer,
-    ) as executor:
-        futures = {
-            executor.submit(execute_commands, dev, args.config_set, args.command, out_dir): dev
-            for dev in devices
-        }
-        for fut in tqdm(as_completed(futures), total=len(futures), desc="执行进度"):
-            dev = futures[fut]
-            try:
-                if fut.result():
-                    ok += 1
-            except Exception as e:
-                log_error(dev.get('host', '?'), f"线程异常: {e}")
+    print(f"共 {len(devices)} 台设备，{mode}，并发 {workers}（握手 {connect_limit}），输出目录: {out_dir}")
+
+    try:
+        threading.stack_size(WORKER_STACK_SIZE)  # 仅影响之后创建的工作线程
+    except (ValueError, RuntimeError):
+        pass
+
+    prefetch_dns(devices, workers)
+    result_writer.start(out_dir, args.output_format, args.atomic)
+    try:
+        ok = batch_execute(devices, args.config_set, cli_cmds, out_dir, workers)
+    finally:
+        result_writer.close()  # 等写线程把剩余结果落盘
 
-    print(f"\n完成：成功 {ok} / 共 {len(devices)} 台，结果在 {out_dir}/")
+    saved = result_writer.written
+    print(f"\n完成：成功 {saved} / 共 {len(devices)} 台，结果在 {out_dir}/")
+    if saved < ok:
+        print(f"[WARN] {ok - saved} 台执行成功但结果保存失败，详见 {ERROR_LOG_FILE}")
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # PyInstaller 打包后多进程解析需要
     main()
@@ -2,21 +2,71 @@
 # -*- coding: utf-8 -*-
 
 import netmiko
-import multiprocessing
-import pandas as pd
+import openpyxl
+import encodings.idna  # noqa: F401  主线程导入一次，避免各工作线程首次解析主机名时争抢导入锁
 import getopt
 import os
+import sys
 import datetime
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import threading
+import queue
+
+# SSH 会话大部分时间阻塞在 socket 上，并发按设备数取值；实际线程数 = min(设备数, -t)
+DEFAULT_THREADS = 128
+WORKER_STACK_SIZE = 1 << 20  # 工作线程只做阻塞 I/O，1 MiB 栈足够（Linux 默认 8 MiB）
+FAILED_FILE = "登录失败列表.txt"
+# 登录失败只入队，由单个写线程持有文件句柄批量追加，不再每次失败 open/write/close
+_failed_q = queue.SimpleQueue()
+
+try:
+   from python_calamine import CalamineWorkbook
+except ImportError:  # 可选依赖
+   CalamineWorkbook = None
+
+
+def _cell(v):
+   # calamine 把整数单元格读成 float（如密码 123456 -> 123456.0），还原为 int
+   if isinstance(v, float) and v.is_integer():
+       return int(v)
+   return "" if v is None else v
 
 
 def load_excel(excel_file):
-   df = pd.read_excel(excel_file, sheet_name="Sheet1")
-   devices_info = df.to_dict(orient="records")
+   # 优先用 python-calamine（Rust 实现）整表解析，未安装时回退 openpyxl 只读模式
+   if CalamineWorkbook is not None:
+       rows = iter(CalamineWorkbook.from_path(excel_file).get_sheet_by_name("Sheet1").to_python())
+       headers = next(rows)
+       return [{h: _cell(v) for h, v in zip(headers, row)} for row in rows if any(row)]
+
+   devices_info = []
+   wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True, keep_links=False)
+   try:
+       sheet = wb["Sheet1"]
+       headers = [c.value for c in next(sheet.iter_rows(min_row=1, max_row=1))]
+       for row in sheet.iter_rows(min_row=2, values_only=True):
+           if not any(row):
+               continue  # 跳过整行空白
+           devices_info.append({h: ("" if v is None else v) for h, v in zip(headers, row)})
+   finally:
+       wb.close()
    return devices_info
 
 
-def execute_commands(devices):
+# 按 device_type 查表选发送方式，未列出的走 _send_default；分支只在表里维护
+def _send_default(conn, cmds):
+   return conn.send_multiline(cmds, cmd_verify=False)
+
+
+SENDERS = {
+   "paloalto_panos": lambda conn, cmds: conn.send_multiline(cmds, expect_string=r">", cmd_verify=False),
+}
+# 这些平台即使填了 secret 也不做 enable
+NO_ENABLE_TYPES = frozenset({"paloalto_panos", "huawei", "huawei_telnet", "hp_comware", "hp_comware_telnet"})
+
+
+def execute_commands(devices, output_dir):
    ip = devices["host"]
    user = devices["username"]
    dev_type = devices["device_type"]
@@ -37,49 +87,84 @@ def execute_commands(devices):
        net_connect = netmiko.ConnectHandler(**net_devices)
        
        with net_connect:
-            if dev_type == "paloalto_panos":
-                cmd_out = net_connect.send_multiline(cmds, expect_string=r">", cmd_verify=False)
-            elif dev_type in ("huawei", "huawei_telnet", "hp_comware", "hp_comware_telnet"):
-                cmd_out = net_connect.send_multiline(cmds, cmd_verify=False)
-            elif secret:
+            if secret and dev_type not in NO_ENABLE_TYPES:
                 net_connect.enable()
-                cmd_out = net_connect.send_multiline(cmds, cmd_verify=False)
-            else:
-                cmd_out = net_connect.send_multiline(cmds, cmd_verify=False)
+            cmd_out = SENDERS.get(dev_type, _send_default)(net_connect, cmds)
 
-       output_dir = f"./result{datetime.datetime.now():%Y%m%d}"
-       os.makedirs(output_dir, exist_ok=True)
        with open(os.path.join(output_dir, f"{ip}.txt"), "w", encoding="utf-8") as tmp_fle:
            tmp_fle.write(cmd_out + "\n")
        print(f"{ip} 执行成功")
-       return cmd_out
+       return True
 
    except netmiko.exceptions.NetmikoAuthenticationException:
-       with open("登录失败列表.txt", "a", encoding="utf-8") as failed_ip:
-           failed_ip.write(f"{ip} 用户名密码错误\n")
+       _failed_q.put(f"{ip} 用户名密码错误\n")
        print(f"{ip} 用户名密码错误")
    except netmiko.exceptions.NetmikoTimeoutException:
-       with open("登录失败列表.txt", "a", encoding="utf-8") as failed_ip:
-           failed_ip.write(f"{ip} 登录超时\n")
+       _failed_q.put(f"{ip} 登录超时\n")
        print(f"{ip} 登录超时")
 
    return None
 
 
+def _write_failed():
+   # 取到一条后把队列里已积压的一并写出；收到 None 表示本轮结束
+   # 首条失败才打开文件，全部成功时不生成空的失败列表
+   f = None
+   try:
+       while True:
+           batch = [_failed_q.get()]
+           while True:
+               try:
+                   batch.append(_failed_q.get_nowait())
+               except queue.Empty:
+                   break
+           lines = [line for line in batch if line is not None]
+           if lines:
+               if f is None:
+                   f = open(FAILED_FILE, "a", encoding="utf-8")
+               f.writelines(lines)
+               f.flush()
+           if len(lines) < len(batch):
+               return
+   finally:
+       if f is not None:
+           f.close()
+
+
 def multithreaded_execution(devices, num_threads):
-   with ThreadPoolExecutor(num_threads) as pool:
-       pool.map(execute_commands, devices)
+   # 日期目录整轮只算一次、建一次，不再每台设备 now() + makedirs
+   output_dir = f"./result{datetime.datetime.now():%Y%m%d}"
+   os.makedirs(output_dir, exist_ok=True)
+   try:
+       threading.stack_size(WORKER_STACK_SIZE)  # 只影响之后新建的工作线程
+   except (ValueError, RuntimeError):
+       pass
+   writer = threading.Thread(target=_write_failed, name="failed-writer", daemon=True)
+   writer.start()
+   try:
+       with ThreadPoolExecutor(max(1, min(len(devices), num_threads))) as pool:
+           run = partial(execute_commands, output_dir=output_dir)
+           futures = {pool.submit(run, dev): dev for dev in devices}
+           # 按完成顺序取结果：认证/超时以外的异常（缺列、读超时等）逐台打印，不再被 map 静默吞掉
+           for future in as_completed(futures):
+               try:
+                   future.result()
+               except Exception as e:
+                   print(f"{futures[future].get('host')} 执行异常: {e}")
+   finally:
+       _failed_q.put(None)
+       writer.join()
 
 
 def main(argv):
    try:
        opts, args = getopt.getopt(argv, "i:t:", ["input=", "threads="])
    except getopt.GetoptError:
-       print("Usage: connexec -i <excel_file> -t <num_threads default:4>")
+       print(f"Usage: connexec -i <excel_file> -t <num_threads default:{DEFAULT_THREADS}>")
        sys.exit(2)
 
    excel_file = ""
-   num_threads = 4
+   num_threads = DEFAULT_THREADS
    for opt, arg in opts:
        if opt in ("-i", "--input"):
            excel_file = arg
@@ -2,28 +2,41 @@
 # -*- coding: utf-8 -*-
 
 import netmiko
-import multiprocessing
 import openpyxl  # Import openpyxl
+import encodings.idna  # noqa: F401  Preload once here so workers never race on the import lock
 import getopt
 import os
 import datetime
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import threading
+import queue
 import sys  # Import sys if not already present
 
+# SSH sessions mostly block on the socket, so size the pool by device count; actual threads = min(devices, -t)
+DEFAULT_THREADS = 128
+WORKER_STACK_SIZE = 1 << 20  # Workers only do blocking I/O; 1 MiB of stack is plenty (Linux default is 8 MiB)
+FAILED_FILE = "登录失败列表.txt"
+# Failures are queued; a single writer thread appends them in batches
+_failed_q = queue.SimpleQueue()
+
 def load_excel(excel_file):
     """Loads device information from an Excel file using openpyxl."""
     devices_info = []
     try:
-        workbook = openpyxl.load_workbook(excel_file)
-        sheet = workbook.active  # Assuming data is in the first sheet
-
-        # Get the header row (first row)
-        header = [cell.value for cell in sheet[1]]
-
-        # Iterate through rows starting from the second row
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            device_data = dict(zip(header, row))
-            devices_info.append(device_data)
+        # Read-only mode streams rows instead of building the whole cell graph
+        workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True, keep_links=False)
+        try:
+            sheet = workbook.active  # Assuming data is in the first sheet
+            rows = sheet.iter_rows(values_only=True)
+
+            # Get the header row (first row), then keep iterating the same generator
+            header = next(rows, ())
+            for row in rows:
+                device_data = dict(zip(header, row))
+                devices_info.append(device_data)
+        finally:
+            workbook.close()  # read-only workbooks keep the zip file open
     except FileNotFoundError:
         print(f"Error: Excel file not found: {excel_file}")
         sys.exit(1)
@@ -34,7 +47,17 @@ def load_excel(excel_file):
 
 # The rest of your code (execute_commands, multithreaded_execution, main) remains largely the same.
 
-def execute_commands(devices):
+# Per-device_type sender lookup; types not listed use _send_default
+def _send_default(conn, cmds):
+   return conn.send_multiline(cmds, cmd_verify=False)
+
+SENDERS = {
+   "paloalto_panos": lambda conn, cmds: conn.send_multiline(cmds, expect_string=r">", cmd_verify=False),
+}
+# Platforms that never enter enable mode, even when a secret is given
+NO_ENABLE_TYPES = frozenset({"paloalto_panos", "huawei", "huawei_telnet", "hp_comware", "hp_comware_telnet"})
+
+def execute_commands(devices, output_dir):
    ip = devices["host"]
    user = devices["username"]
    dev_type = devices["device_type"]
@@ -55,47 +78,81 @@ def execute_commands(devices):
        net_connect = netmiko.ConnectHandler(**net_devices)
 
        with net_connect:
-            if dev_type == "paloalto_panos":
-                cmd_out = net_connect.send_multiline(cmds, expect_string=r">", cmd_verify=False)
-            elif dev_type in ("huawei", "huawei_telnet", "hp_comware", "hp_comware_telnet"):
-                cmd_out = net_connect.send_multiline(cmds, cmd_verify=False)
-            elif secret:
+            if secret and dev_type not in NO_ENABLE_TYPES:
                 net_connect.enable()
-                cmd_out = net_connect.send_multiline(cmds, cmd_verify=False)
-            else:
-                cmd_out = net_connect.send_multiline(cmds, cmd_verify=False)
+            cmd_out = SENDERS.get(dev_type, _send_default)(net_connect, cmds)
 
-       output_dir = f"./result{datetime.datetime.now():%Y%m%d}"
-       os.makedirs(output_dir, exist_ok=True)
        with open(os.path.join(output_dir, f"{ip}.txt"), "w", encoding="utf-8") as tmp_fle:
            tmp_fle.write(cmd_out + "\n")
        print(f"{ip} 执行成功")
-       return cmd_out
+       return True
 
    except netmiko.exceptions.NetmikoAuthenticationException:
-       with open("登录失败列表.txt", "a", encoding="utf-8") as failed_ip:
-           failed_ip.write(f"{ip} 用户名密码错误\n")
+       _failed_q.put(f"{ip} 用户名密码错误\n")
        print(f"{ip} 用户名密码错误")
    except netmiko.exceptions.NetmikoTimeoutException:
-       with open("登录失败列表.txt", "a", encoding="utf-8") as failed_ip:
-           failed_ip.write(f"{ip} 登录超时\n")
+       _failed_q.put(f"{ip} 登录超时\n")
        print(f"{ip} 登录超时")
 
    return None
 
+def _write_failed():
+   # Drain whatever has piled up after each get; None ends the run.
+   # The file is opened on the first failure only, so clean runs leave no empty list.
+   f = None
+   try:
+       while True:
+           batch = [_failed_q.get()]
+           while True:
+               try:
+                   batch.append(_failed_q.get_nowait())
+               except queue.Empty:
+                   break
+           lines = [line for line in batch if line is not None]
+           if lines:
+               if f is None:
+                   f = open(FAILED_FILE, "a", encoding="utf-8")
+               f.writelines(lines)
+               f.flush()
+           if len(lines) < len(batch):
+               return
+   finally:
+       if f is not None:
+           f.close()
+
 def multithreaded_execution(devices, num_threads):
-   with ThreadPoolExecutor(num_threads) as pool:
-       pool.map(execute_commands, devices)
+   # Compute and create the dated output directory once per run, not per device
+   output_dir = f"./result{datetime.datetime.now():%Y%m%d}"
+   os.makedirs(output_dir, exist_ok=True)
+   try:
+       threading.stack_size(WORKER_STACK_SIZE)  # Only affects worker threads created after this
+   except (ValueError, RuntimeError):
+       pass
+   writer = threading.Thread(target=_write_failed, name="failed-writer", daemon=True)
+   writer.start()
+   try:
+       with ThreadPoolExecutor(max(1, min(len(devices), num_threads))) as pool:
+           run = partial(execute_commands, output_dir=output_dir)
+           futures = {pool.submit(run, dev): dev for dev in devices}
+           # Drain in completion order so unexpected errors are reported instead of lost in map()
+           for future in as_completed(futures):
+               try:
+                   future.result()
+               except Exception as e:
+                   print(f"{futures[future].get('host')} 执行异常: {e}")
+   finally:
+       _failed_q.put(None)
+       writer.join()
 
 def main(argv):
    try:
        opts, args = getopt.getopt(argv, "i:t:", ["input=", "threads="])
    except getopt.GetoptError:
-       print("Usage: connexec -i <excel_file> -t <num_threads default:4>")
+       print(f"Usage: connexec -i <excel_file> -t <num_threads default:{DEFAULT_THREADS}>")
        sys.exit(2)
 
    excel_file = ""
-   num_threads = 4
+   num_threads = DEFAULT_THREADS
    for opt, arg in opts:
        if opt in ("-i", "--input"):
            excel_file = arg
@@ -5,28 +5,39 @@ import netmiko
 import openpyxl
 import getopt
 import os
+import itertools
 import datetime
 import sys
-import encodings.idna  # 关键预加载
-from typing import List, Dict
-from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
+import re
+import time
+import queue
+import atexit
+import zipfile
+import xml.etree.ElementTree as ET
+import encodings.idna  # noqa: F401  关键预加载（模块级一次即可，工作线程共享）
+from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock, Thread
 from tqdm import tqdm
 
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # 可选依赖，未安装时回退到 openpyxl 只读模式
+    CalamineWorkbook = None
+
 # 环境配置
 os.environ["NO_COLOR"] = "1"  # 禁用彩色输出
-write_lock = Lock()           # 全局写入锁
-
-def thread_initializer():
-    """线程初始化函数（解决编码问题）"""
-    import encodings.idna
-    encodings.idna  # 防止被优化
+write_lock = Lock()           # 仅保护错误写线程的首次启动
+# SSH 下发属于网络 I/O 密集，线程绝大部分时间阻塞在 socket 读写上（不占 GIL），
+# 并发度按设备数取值而非 CPU 数；实际线程数 = min(设备数, -t)
+DEFAULT_THREADS = 128
+MAX_THREADS = int(os.environ.get("MDEV_MAX_THREADS", "512"))  # -t 上限，超出只增开销不增速度
+# 文件名非法字符删除表：str.translate 在 C 层一次过滤，不再逐字符生成字符串
+FILENAME_BAD_CHARS = str.maketrans('', '', '<>:"/\\|?*')
 
 def sanitize_filename(name: str) -> str:
     """生成安全文件名"""
-    invalid_chars = r'<>:"/\|?*'
-    clean_name = ''.join(c for c in name if c not in invalid_chars).strip()
-    return clean_name[:50]  # 限制长度
+    return name.translate(FILENAME_BAD_CHARS).strip()[:50]  # 限制长度
 
 def validate_device_data(device: Dict, row_idx: int):
     """验证设备数据完整性"""
@@ -38,24 +49,70 @@ def validate_device_data(device: Dict, row_idx: int):
     
 
 
+# workbook.xml 命名空间
+_XL_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+def active_sheet_name(excel_file: str) -> Optional[str]:
+    """工作簿保存时的活动工作表名（workbook.xml 的 activeTab，缺省为第一个），只读 workbook.xml，
+    不解析单元格；不是 xlsx（xls/ods）时返回 None"""
+    try:
+        with zipfile.ZipFile(excel_file) as zf:
+            root = ET.fromstring(zf.read('xl/workbook.xml'))
+        view = root.find(f'{_XL_NS}bookViews/{_XL_NS}workbookView')
+        idx = int(view.get('activeTab', 0)) if view is not None else 0
+        return root.findall(f'{_XL_NS}sheets/{_XL_NS}sheet')[idx].get('name')
+    except (zipfile.BadZipFile, KeyError, IndexError, ValueError):
+        return None
+
+def read_active_sheet(excel_file: str) -> List[tuple]:
+    """读取活动工作表（与 openpyxl 的 wb.active 一致）的全部行：优先 python-calamine
+    （Rust 实现，整表解析快一个量级），未安装时用 openpyxl 只读模式流式读取"""
+    if CalamineWorkbook is not None:
+        wb = CalamineWorkbook.from_path(excel_file)
+        name = active_sheet_name(excel_file)
+        sheet = wb.get_sheet_by_name(name) if name in wb.sheet_names else wb.get_sheet_by_index(0)
+        return sheet.to_python()
+    wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True, keep_links=False)
+    try:
+        return list(wb.active.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+def cell_str(v) -> str:
+    """单元格转字符串（calamine 把整数读成 float，15.0 还原为 15）"""
+    if type(v) is str:  # 文本单元格占绝大多数，直接 strip，不走 str()
+        return v.strip()
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
+
 def load_excel(excel_file: str) -> List[Dict]:
     """加载并验证Excel设备信息"""
     devices = []
     try:
-        wb = openpyxl.load_workbook(excel_file)
-        sheet = wb.active
+        rows = read_active_sheet(excel_file)
         
         # 解析表头
-        headers = [str(cell.value).lower().strip() for cell in sheet[1]]
+        headers = tuple(str(h).lower().strip() for h in rows[0])
         required = ['host', 'username', 'password', 'device_type']
         if any(f not in headers for f in required):
             print(f"缺少必要列: {', '.join(required)}")
             sys.exit(1)
         
         # 处理数据行
-        for idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), 2):
-            device = {k: str(v).strip() if v else "" for k, v in zip(headers, row)}
+        # dict(zip(...)) 在 C 层逐列建字典；整行空白（any 遇到首个非空即停）直接跳过
+        for idx, row in enumerate(itertools.islice(rows, 1, None), 2):
+            if not any(row):
+                continue
+            device = dict(zip(headers, map(cell_str, row)))
             validate_device_data(device, idx)
+            # readtime 在加载时换算一次：填错的在这里报出行号，不会到合并/连接阶段才抛异常
+            try:
+                device['_read_timeout'] = int(device.get('readtime') or 10)
+            except ValueError:
+                raise ValueError(f"第{idx}行 readtime 不是整数: {device['readtime']}") from None
             devices.append(device)
             
         return devices
@@ -64,6 +121,22 @@ def load_excel(excel_file: str) -> List[Dict]:
         print(f"Excel处理失败: {str(e)}")
         sys.exit(1)
 
+def coalesce_devices(devices: List[Dict]) -> List[Dict]:
+    """同一设备（host/username/device_type 相同）的多行合并为一台：命令按行序拼接、
+    readtime 取最大；只连一次，结果文件也不会被同名行互相覆盖"""
+    grouped: Dict[tuple, Dict] = {}
+    for dev in devices:
+        key = (dev['host'], dev['username'], dev['device_type'])
+        if (first := grouped.get(key)) is None:
+            grouped[key] = dict(dev)
+            continue
+        first['mult_command'] = ';'.join(c for c in (first.get('mult_command'), dev.get('mult_command')) if c)
+        first['_read_timeout'] = max(first['_read_timeout'], dev['_read_timeout'])
+    return list(grouped.values())
+
+# 默认开启 fast_cli；--safe-delays 关闭，恢复保守延迟
+SAFE_DELAYS = False
+
 def connect_device(device: Dict) -> netmiko.BaseConnection:
     """建立设备连接"""
     params = {
@@ -72,8 +145,8 @@ def connect_device(device: Dict) -> netmiko.BaseConnection:
         'username': device['username'],
         'password': device['password'],
         'secret': device.get('secret', ''),
-        'read_timeout_override': int(device.get('readtime', 10)),
-        'fast_cli': False
+        'read_timeout_override': device['_read_timeout'],
+        'fast_cli': not SAFE_DELAYS and not device['device_type'].endswith('_telnet'),
     }
     
     try:
@@ -85,7 +158,19 @@ def connect_device(device: Dict) -> netmiko.BaseConnection:
         log_error(device['host'], str(e))
         return None
 
-def execute_commands(device: Dict) -> str:
+# 可整批写入命令、按提示符逐条读回的平台（show 类命令不依赖逐条提示符交互），其余仍逐条等待
+PIPELINE_TYPES = frozenset({
+    'cisco_ios', 'cisco_xe', 'cisco_nxos', 'cisco_xr', 'arista_eos',
+    'huawei', 'hp_comware', 'juniper', 'juniper_junos', 'ruijie_os',
+})
+
+def send_pipelined(conn: netmiko.BaseConnection, cmds: List[str], prompt: str, read_timeout: float) -> str:
+    """整批写入命令后逐条读到提示符，返回拼接后的原始输出（含回显与提示符）。"""
+    conn.write_channel(conn.RETURN.join(cmds) + conn.RETURN)
+    pattern = re.escape(prompt)
+    return ''.join(conn.read_until_pattern(pattern=pattern, read_timeout=read_timeout) for _ in cmds)
+
+def execute_commands(device: Dict, output_dir: str) -> str:
     """执行设备命令主逻辑"""
     ip = device['host']
     
@@ -102,19 +187,22 @@ def execute_commands(device: Dict) -> str:
             return None
             
         with conn:
-            
-            conn.send_command_timing('')
-
+            # 新建的 Netmiko 会话在登录时已读空 banner，无需再发空行清缓冲
+            # 文件名用登录时 Netmiko 已探测的 base_prompt，不再为此多一次 find_prompt 往返
+            prompt = conn.base_prompt or conn.find_prompt()
             if device['device_type'] == 'paloalto_panos':
                 output = conn.send_multiline(cmds, expect_string=r">", cmd_verify=False)
+            elif len(cmds) > 1 and device['device_type'] in PIPELINE_TYPES:
+                output = send_pipelined(conn, cmds, conn.find_prompt().strip(), device['_read_timeout'])
             else:
                 output = conn.send_multiline(cmds, cmd_verify=False)
             
             # 保存结果
             save_result(
                 ip=ip,
-                prompt=conn.find_prompt(),
-                output=output
+                prompt=prompt,
+                output=output,
+                output_dir=output_dir
             )
             
             return output
@@ -123,58 +211,104 @@ def execute_commands(device: Dict) -> str:
         log_error(ip, str(e))
         return None
 
-def save_result(ip: str, prompt: str, output: str):
-    """保存执行结果"""
-    date_str = datetime.datetime.now().strftime('%Y%m%d')
+def save_result(ip: str, prompt: str, output: str, output_dir: str):
+    """保存执行结果（output_dir 由 batch_execute 预先创建）"""
     hname = sanitize_filename(prompt.strip('#<>[]*:?'))
     
-    output_dir = f"./result_{date_str}"
-    os.makedirs(output_dir, exist_ok=True)
-    
     filename = f"{sanitize_filename(ip)}_{hname}.txt"
     content = f"=== 设备 {ip} 执行结果 ===\n{output}"
     
-    with write_lock:
-        with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
-            f.write(content)
+    # 每台设备写各自的文件，互不冲突，无需全局锁串行化
+    with open(os.path.join(output_dir, filename), 'w', encoding='utf-8', buffering=1 << 16) as f:
+        f.write(content)
+
+# 错误日志：工作线程只入队（SimpleQueue 无锁），由单个线程持有文件句柄批量写入
+ERROR_FLUSH_LINES = 64      # 累计多少行刷一次盘
+ERROR_FLUSH_INTERVAL = 0.25  # 或距上次刷盘多少秒
+_err_q: "queue.SimpleQueue" = queue.SimpleQueue()
+_err_thread = None
+
+def _drain_errors():
+    """错误日志写线程：收到 None 时刷盘退出"""
+    with open("error_log.txt", 'a', encoding='utf-8') as f:
+        pending, last_flush = 0, time.monotonic()
+        while True:
+            try:
+                msg = _err_q.get(timeout=ERROR_FLUSH_INTERVAL)
+            except queue.Empty:
+                msg = ()
+            if msg is None:
+                break
+            if msg:
+                ip, error = msg
+                f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {ip} | {error}\n")
+                pending += 1
+            if pending and (pending >= ERROR_FLUSH_LINES
+                            or time.monotonic() - last_flush >= ERROR_FLUSH_INTERVAL):
+                f.flush()
+                pending, last_flush = 0, time.monotonic()
+
+def _stop_error_writer():
+    if _err_thread is not None:
+        _err_q.put(None)
+        _err_thread.join()
 
 def log_error(ip: str, error: str):
     """统一错误日志记录"""
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    msg = f"{timestamp} | {ip} | {error}"
-    
-    with write_lock:
-        with open("error_log.txt", 'a', encoding='utf-8') as f:
-            f.write(msg + '\n')
+    global _err_thread
+    if _err_thread is None:
+        with write_lock:  # 只在首次记错时抢锁启动写线程
+            if _err_thread is None:
+                _err_thread = Thread(target=_drain_errors, name="error-writer", daemon=True)
+                _err_thread.start()
+                atexit.register(_stop_error_writer)
+    _err_q.put((ip, error))  # 时间戳由写线程打，工作线程只交出原始信息
     print(f"{ip} [错误] {error}")
 
-def batch_execute(devices: List[Dict], max_workers: int = 4):
+def batch_execute(devices: List[Dict], max_workers: int = DEFAULT_THREADS):
     """批量执行入口"""
-    with ThreadPoolExecutor(
-        max_workers=max_workers,
-        initializer=thread_initializer
-    ) as executor:
+    # 输出目录只在开始时计算并创建一次，不再每台设备 makedirs
+    output_dir = f"./result_{datetime.datetime.now():%Y%m%d}"
+    os.makedirs(output_dir, exist_ok=True)
+    workers = min(len(devices), max_workers) or 1
+    inflight = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mdev') as executor:
         try:
-            results = list(tqdm(
-                executor.map(execute_commands, devices),
+            progress = tqdm(
                 total=len(devices),
                 desc="执行进度",
                 unit="台",
+                mininterval=0.2,  # 大批量时合并重绘，不再每台都写终端
+                miniters=max(1, len(devices) // 200),
                 bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt}"
-            ))
+            )
+            success = 0
+            # 有界提交：最多领先 workers*2 个任务；按完成顺序取结果，
+            # 已完成的 Future 连同其输出随即释放，不再整批留到最后
+            for dev in sorted(devices, key=lambda d: d['device_type']):  # 同类设备集中提交，类内保持行序
+                if len(inflight) >= workers * 2:
+                    done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    success += sum(f.result() is not None for f in done)
+                    progress.update(len(done))
+                inflight.add(executor.submit(execute_commands, dev, output_dir))
+            success += sum(f.result() is not None for f in wait(inflight).done)
+            progress.update(len(inflight))
+            progress.close()
             
-            success = sum(1 for r in results if r is not None)
             print(f"\n执行完成: 成功 {success} 台 | 失败 {len(devices)-success} 台")
             
         except KeyboardInterrupt:
             print("\n正在安全终止...")
-            executor.shutdown(wait=False)
+            # 撤掉尚未开始的任务，退出 with 时只等正在执行的会话收尾
+            for f in inflight:
+                f.cancel()
             sys.exit(1)
 
 
 
 def main(argv):
     """命令行入口"""
+    global SAFE_DELAYS
     usage = """
 网络设备批量配置工具 v2.4
 
@@ -189,7 +323,8 @@ def main(argv):
 
 参数说明:
   -i, --input    必需  Excel文件路径
-  -t, --threads  可选  并发线程线程（最小值1，默认4）
+  -t, --threads  可选  最大并发线程数（最小值1，默认128，实际取 min(设备数, 该值)）
+  --safe-delays  可选  关闭 fast_cli，恢复保守延迟（老旧或响应慢的设备）
 
 示例excel模板:
   host          username  password    device_type  secret   readtime  mult_command
@@ -201,13 +336,13 @@ def main(argv):
 """
     
     try:
-        opts, _ = getopt.getopt(argv, "hi:t:", ["help", "input=", "threads="])
+        opts, _ = getopt.getopt(argv, "hi:t:", ["help", "input=", "threads=", "safe-delays"])
     except getopt.GetoptError:
         print(usage)
         sys.exit(2)
         
     excel_file = ""
-    threads = 4
+    threads = DEFAULT_THREADS
     
     for opt, arg in opts:
         if opt in ("-h", "--help"):
@@ -217,6 +352,11 @@ def main(argv):
             excel_file = arg
         elif opt in ("-t", "--threads"):
             threads = max(1, int(arg))
+            if threads > MAX_THREADS:
+                print(f"[警告] -t {threads} 超过上限，按 {MAX_THREADS} 执行（MDEV_MAX_THREADS 可调整）")
+                threads = MAX_THREADS
+        elif opt == "--safe-delays":
+            SAFE_DELAYS = True
             
     if not excel_file or not os.path.exists(excel_file):
         print(usage)
@@ -225,6 +365,9 @@ def main(argv):
     try:
         devices = load_excel(excel_file)
         print(f"已加载设备: {len(devices)} 台")
+        if len(merged := coalesce_devices(devices)) < len(devices):
+            print(f"合并重复设备: {len(devices)} 行 -> {len(merged)} 台")
+            devices = merged
         batch_execute(devices, threads)
     except KeyboardInterrupt:
         print("\n用户终止操作")
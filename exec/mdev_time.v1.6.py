@@ -1,74 +1,143 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import netmiko
-import openpyxl
+from __future__ import annotations
+
 import argparse
 import os
 import datetime
 import sys
 import re
-import uuid
-import tempfile
-from typing import List, Dict, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-import encodings.idna
-from tqdm import tqdm
-from netmiko import NetmikoTimeoutException, NetmikoAuthenticationException
+import queue
+import itertools
+import functools
+import time
+import signal
+import socket
+from operator import itemgetter
+from typing import TYPE_CHECKING, List, Dict, Optional
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Event, Thread, stack_size
+import encodings.idna  # noqa: F401  主线程预加载一次，工作线程无需再导入
+
+if TYPE_CHECKING:
+    import netmiko
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # 可选依赖，未安装时回退 openpyxl
+    CalamineWorkbook = None
+# netmiko/openpyxl/tqdm 用到时才导入：--help 等不连设备的调用不付几百毫秒的导入开销
+_netmiko = None
+
+def get_netmiko():
+    """延迟导入 netmiko，只导入一次"""
+    global _netmiko
+    if _netmiko is None:
+        import netmiko as _netmiko
+    return _netmiko
 
 # 环境配置
 os.environ["NO_COLOR"] = "1"
-write_lock = Lock()
-DEFAULT_THREADS = min(900, max(4, (os.cpu_count() or 4)))
-
-def thread_initializer() -> None:
-    """线程初始化（解决编码问题）"""
-    import encodings.idna
-    encodings.idna.__name__  # 防止被优化
+# 结果与错误行共用一个队列、一个写线程：(ip, 路径, 内容)，路径为 None 表示错误行；None 为结束标记
+result_queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+_error_log = None  # 写线程首次记错时打开，之后复用同一句柄
+# SSH 会话绝大部分时间阻塞在 socket 上，并发度与 CPU 核数无关；
+# 实际线程数再按设备数收窄，避免为几十台设备起上百个线程
+DEFAULT_THREADS = 128
+MAX_THREADS = int(os.environ.get("MDEV_MAX_THREADS", "512"))  # -t 上限，超出只增开销不增速度
+WORKER_STACK_SIZE = 1 << 20  # 工作线程只做阻塞 I/O，1 MiB 栈足够（Linux 默认 8 MiB）
+FILENAME_BAD_CHARS = str.maketrans('', '', '\\/*?:"<>|')
+SECRET_RE = re.compile(r'(password|secret)\s*=\s*\S+', re.I)
+PROMPT_RE = re.compile(r'\S*?([\w.\-]+)\s*(?:\([^)]*\))?\s*[#>$\]]')  # 提示符取主机名：R1#、<HUAWEI>、[H3C]、admin@fw(active)>
+BASE_PROMPT_RE = re.compile(r'([\w.\-]+)\s*(?:\([^)]*\))?\s*$')  # base_prompt 已去掉结束符：R1、HUAWEI、admin@fw
+# 默认开启 fast_cli（Netmiko 内部等待按 0.1 倍缩短）；--safe-delays 恢复原有保守延迟，供老旧/慢设备使用
+SAFE_DELAYS = False
+# 首次 Ctrl+C 只置位停止标志：未开始的设备取消，在途会话收尾，结果照常落盘；再按一次立即退出
+_stop = Event()
+# 调试日志序号（进程号-自增序号）
+_DEBUG_LOG_PREFIX = f"{os.getpid():x}-"
+_debug_log_seq = itertools.count()
 
 def sanitize_filename(name: str) -> str:
     """生成安全文件名"""
-    return re.sub(r'[\\/*?:"<>|]', '', name).strip()[:60]
+    return name.translate(FILENAME_BAD_CHARS).strip()[:60]
+
+REQUIRED_FIELDS = ('host', 'username', 'password', 'device_type')
+_required_values = itemgetter(*REQUIRED_FIELDS)
 
 def validate_device_data(device: Dict[str, str], row_idx: int) -> None:
-    """验证设备数据完整性"""
-    required = ['host', 'username', 'password', 'device_type']
-    if missing := [f for f in required if not device.get(f)]:
-        raise ValueError(f"Row {row_idx} 缺失字段: {', '.join(missing)}")
+    """验证设备数据完整性（表头已校验过必填列存在）"""
+    if all(_required_values(device)):
+        return
+    missing = [f for f in REQUIRED_FIELDS if not device[f]]
+    raise ValueError(f"Row {row_idx} 缺失字段: {', '.join(missing)}")
+
+def iter_sheet_rows(excel_file: str, sheet_name: str):
+    """逐行产出工作表的值元组：装了 python-calamine 时用它（Rust 解析，快一个量级），
+    否则 openpyxl 只读模式流式读取"""
+    if CalamineWorkbook is not None:
+        wb = CalamineWorkbook.from_path(excel_file)
+        if sheet_name not in wb.sheet_names:
+            raise ValueError(f"工作表 '{sheet_name}' 不存在")
+        yield from wb.get_sheet_by_name(sheet_name).to_python()
+        return
+
+    import openpyxl
+    wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True, keep_links=False)
+    try:
+        if sheet_name not in wb.sheetnames:
+            raise ValueError(f"工作表 '{sheet_name}' 不存在")
+        yield from wb[sheet_name].iter_rows(values_only=True)
+    finally:
+        wb.close()  # 只读工作簿持有 zip 句柄，读完即释放
+
+def cell_str(cell) -> str:
+    """单元格转字符串（calamine 把整数读成 float，123456.0 还原为 123456）"""
+    if type(cell) is str:  # 绝大多数单元格是文本，先判断，直接 strip
+        return cell.strip()
+    if cell is None:
+        return ""
+    if isinstance(cell, float) and cell.is_integer():
+        cell = int(cell)
+    return str(cell).strip()
+
+def split_commands(raw: str) -> List[str]:
+    """按 ; 拆分命令并去掉空项"""
+    return [c.strip() for c in raw.split(';') if c.strip()]
 
 def load_excel(excel_file: str, sheet_name: str = 'Sheet1') -> List[Dict[str, str]]:
     """加载Excel设备清单（线程安全+版本兼容）"""
     devices = []
-    wb = None
     try:
-        # 方式1：直接加载（兼容旧版）
-        wb = openpyxl.load_workbook(excel_file, read_only=True)
-        
-        # 方式2：如果升级到openpyxl>=3.0可改用：
-        # with openpyxl.load_workbook(excel_file, read_only=True) as wb:
-        
-        if sheet_name not in wb.sheetnames:
-            raise ValueError(f"工作表 '{sheet_name}' 不存在")
-        sheet = wb[sheet_name]
-        
-        headers = [str(cell.value).lower().strip() for cell in sheet[1]]
-        required = ['host', 'username', 'password', 'device_type']
-        if missing := [f for f in required if f not in headers]:
+        # 表头与数据行共用一个生成器，不再单独取 sheet[1]
+        rows = iter_sheet_rows(excel_file, sheet_name)
+        headers = tuple(str(h).lower().strip() if h else "" for h in next(rows, ()))
+        header_set = frozenset(headers)
+        if missing := [f for f in REQUIRED_FIELDS if f not in header_set]:
             raise ValueError(f"缺少必要列: {', '.join(missing)}")
 
-        for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), 2):
-            device = {headers[i]: str(cell).strip() if cell else "" for i, cell in enumerate(row)}
+        for row_idx, row in enumerate(rows, 2):
+            if not any(row):
+                continue  # 只读模式会带出带格式的空行，跳过而不是报缺字段
+            device = dict(zip(headers, map(cell_str, row)))
             validate_device_data(device, row_idx)
+            # 命令拆分与超时换算在加载时做一次，工作线程直接取用
+            device['_cmds'] = split_commands(device.get('mult_command', ''))
+            device['_read_timeout'] = int(device.get('readtime') or 20)
             devices.append(device)
             
         return devices
     except Exception as e:
         print(f"Excel处理失败: {str(e)}")
         sys.exit(1)
-    finally:
-        if wb:  # 确保资源释放
-            wb.close()
+
+@functools.lru_cache(maxsize=None)
+def debug_log_dir() -> str:
+    """调试日志目录（整轮只取一次日期、建一次目录）"""
+    path = os.path.join("debug_logs", time.strftime('%Y%m%d'))
+    os.makedirs(path, exist_ok=True)
+    return path
 
 def connect_device(device: Dict[str, str]) -> Optional[netmiko.BaseConnection]:
     """设备连接（自动生成独立日志文件）"""
@@ -78,90 +147,176 @@ def connect_device(device: Dict[str, str]) -> Optional[netmiko.BaseConnection]:
         'username': device['username'],
         'password': device['password'],
         'secret': device.get('secret', ''),
-        'read_timeout_override': int(device.get('readtime', 20)),
-        'fast_cli': False
+        'read_timeout_override': device['_read_timeout'],
+        'fast_cli': not SAFE_DELAYS and not device['device_type'].endswith('_telnet'),
     }
 
     # 动态生成设备专属日志路径
     if device.get('debug'):
-        debug_dir = os.path.join("debug_logs", datetime.datetime.now().strftime('%Y%m%d'))
-        os.makedirs(debug_dir, exist_ok=True)
-        log_file = f"{sanitize_filename(device['host'])}_{uuid.uuid4().hex[:6]}.log"
-        params['session_log'] = os.path.join(debug_dir, log_file)
+        log_file = f"{sanitize_filename(device['host'])}_{_DEBUG_LOG_PREFIX}{next(_debug_log_seq):03x}.log"
+        params['session_log'] = os.path.join(debug_log_dir(), log_file)
 
+    nm = get_netmiko()
     try:
-        conn = netmiko.ConnectHandler(**params)
+        conn = nm.ConnectHandler(**params)
         if params['secret']:
             conn.enable()
         return conn
-    except (NetmikoTimeoutException, NetmikoAuthenticationException) as e:
+    except (nm.NetmikoTimeoutException, nm.NetmikoAuthenticationException) as e:
         log_error(device['host'], f"{e.__class__.__name__}: {str(e)}")
     except Exception as e:
         log_error(device['host'], f"连接异常: {str(e)}")
     return None
 
+def device_key(device: Dict[str, str]) -> tuple:
+    """同一设备的判定键；同键的多行由 coalesce_devices 合并，每台只建一次会话、用完即断开"""
+    return (device['host'], device['username'], device['device_type'])
+
+# 可整批写入命令、按提示符逐条读回的平台（show 类命令不依赖逐条提示符交互）；
+# paloalto_panos 等提示符不稳定的平台仍走 send_multiline 逐条等待
+PIPELINE_TYPES = frozenset({
+    'cisco_ios', 'cisco_xe', 'cisco_nxos', 'cisco_xr', 'arista_eos',
+    'huawei', 'hp_comware', 'juniper', 'juniper_junos', 'ruijie_os',
+})
+
+def send_pipelined(conn: netmiko.BaseConnection, cmds: List[str], prompt: str, read_timeout: float) -> str:
+    """写入全部命令，再读回 len(cmds) 段、每段以提示符结尾，每段各自以 read_timeout 为上限"""
+    conn.write_channel(conn.RETURN.join(cmds) + conn.RETURN)
+    pattern = re.escape(prompt)
+    return ''.join(conn.read_until_pattern(pattern=pattern, read_timeout=read_timeout) for _ in cmds)
+
 def execute_commands(device: Dict[str, str], config_set: bool) -> Optional[str]:
     """执行命令并捕获输出"""
     try:
-        cmds = [c.strip() for c in device.get('mult_command', '').split(';') if c.strip()]
+        cmds = device['_cmds']
         if not cmds:
             print(f"{device['host']} [WARN] 无有效命令")
             return None
 
-        if not (conn := connect_device(device)):
+        if _stop.is_set() or not (conn := connect_device(device)):
             return None
 
         with conn:
-            # 获取设备主机名
-            prompt = conn.find_prompt().strip()
-            device['hostname'] = (
-                re.search(r'\S+?([\w-]+)[#>]', prompt).group(1) 
-                if re.search(r'\S+?([\w-]+)[#>]', prompt) 
-                else 'unknown'
-            )
+            # 获取设备主机名：登录时 Netmiko 已探测 base_prompt，拿不到才 find_prompt 多一次往返
+            m = (BASE_PROMPT_RE.search(getattr(conn, 'base_prompt', None) or '')
+                 or PROMPT_RE.search(conn.find_prompt().strip()))
+            device['hostname'] = m.group(1) if m else 'unknown'
 
             # 执行命令
-            return (
-                conn.send_config_set(cmds, cmd_verify=False) 
-                if config_set 
-                else conn.send_multiline(cmds)
-            )
+            if _stop.is_set():
+                return None
+            if config_set:
+                return conn.send_config_set(cmds, cmd_verify=False)
+            if len(cmds) > 1 and device['device_type'] in PIPELINE_TYPES:
+                # 按提示符判断读完，只有这里需要完整提示符
+                return send_pipelined(conn, cmds, conn.find_prompt().strip(), device['_read_timeout'])
+            return conn.send_multiline(cmds, cmd_verify=False)
     except Exception as e:
         log_error(device['host'], f"执行异常: {str(e)}")
         return None
 
-def save_result(ip: str, hostname: str, output: str, dest_path: str) -> None:
-    """保存执行结果（原子写入）"""
-    date_str = datetime.datetime.now().strftime('%Y%m%d')
-    output_dir = os.path.join(dest_path, f"result_{date_str}")
-    os.makedirs(output_dir, exist_ok=True)
-
+def save_result(ip: str, hostname: str, output: str, output_dir: str) -> None:
+    """保存执行结果（output_dir 由 batch_execute 预先创建）"""
     filename = f"{sanitize_filename(ip)}_{hostname or 'unknown'}.txt"
     content = f"=== {ip} ({hostname}) 执行结果 ===\n{output}"
 
+    # 只入队，由写线程统一落盘，工作线程不在磁盘 I/O 上等待
+    result_queue.put((ip, os.path.join(output_dir, filename), content))
+
+def flush_errors(lines: List[str]) -> None:
+    """攒下的错误行一次追加到 error.log（仅写线程调用）；写不进去时改打到 stderr，写线程照常运行"""
+    global _error_log
+    text = '\n'.join(lines) + '\n'
+    lines.clear()
     try:
-        with tempfile.NamedTemporaryFile(
-            mode='w', 
-            encoding='utf-8',
-            delete=False, 
-            dir=output_dir
-        ) as tmp_file:
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
-        
-        os.rename(tmp_path, os.path.join(output_dir, filename))
+        if _error_log is None:
+            _error_log = open("error.log", 'a', encoding='utf-8')
+        _error_log.write(text)
+        _error_log.flush()
     except OSError as e:
-        log_error(ip, f"文件保存失败: {str(e)}")
+        if _error_log is not None:
+            try:
+                _error_log.close()
+            except OSError:
+                pass
+            _error_log = None  # 下次再重新打开
+        print(f"error.log 写入失败: {e}", file=sys.stderr)
+        sys.stderr.write(text)
+
+def writer_loop() -> None:
+    """写线程：结果逐个写文件；错误行攒到队列暂空再合并写一次，遇到 None 结束"""
+    errors: List[str] = []
+    while True:
+        if errors and (len(errors) >= 128 or result_queue.empty()):
+            flush_errors(errors)
+        if (item := result_queue.get()) is None:
+            break
+        ip, path, content = item
+        if path is None:
+            errors.append(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {ip} | {content}")
+            continue
+        try:
+            with open(path, 'w', encoding='utf-8', buffering=1 << 16) as f:
+                f.write(content)
+        except OSError as e:
+            log_error(ip, f"文件保存失败: {str(e)}")
+    # 结束前取净队列：写线程自己记的错误行可能排在结束标记之后
+    while True:
+        try:
+            item = result_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not None and item[1] is None:
+            errors.append(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {item[0]} | {item[2]}")
+    if errors:
+        flush_errors(errors)
 
 def log_error(ip: str, error: str) -> None:
-    """安全记录错误日志"""
-    sanitized = re.sub(r'(password|secret)\s*=\s*\S+', r'\1=***', error, flags=re.I)
-    log_line = f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} | {ip} | {sanitized}"
-    
-    with write_lock:
-        with open("error.log", 'a', encoding='utf-8') as f:
-            f.write(log_line + '\n')
-        print(f"{ip} [ERROR] {sanitized}")
+    """安全记录错误日志（只入队 (ip, 错误)，时间戳与行格式由写线程完成，工作线程不争锁也不做文件 I/O）"""
+    sanitized = SECRET_RE.sub(r'\1=***', error)
+    result_queue.put((ip, None, sanitized))
+    print(f"{ip} [ERROR] {sanitized}")
+
+def coalesce_devices(devices: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """同一设备（device_key 相同）的多行合并为一台：命令按行序拼接、readtime 取最大，
+    只建一次会话，结果文件也不会被同名行互相覆盖"""
+    grouped: Dict[tuple, Dict[str, str]] = {}
+    for dev in devices:
+        key = device_key(dev)
+        if (first := grouped.get(key)) is None:
+            grouped[key] = {**dev, '_cmds': list(dev['_cmds'])}
+            continue
+        first['_cmds'].extend(dev['_cmds'])
+        first['_read_timeout'] = max(first['_read_timeout'], dev['_read_timeout'])
+    return list(grouped.values())
+
+# 派发前批量探测 SSH/Telnet 端口（秒）：不通的设备直接记失败，不占 SSH 工作线程、不等 Netmiko 超时；0 关闭
+PORT_PROBE_TIMEOUT = float(os.environ.get("MDEV_PORT_PROBE_TIMEOUT", "2"))
+PROBE_THREADS = 256  # 探测只是一次 TCP 握手，并发可远高于会话线程
+
+def port_open(device: Dict[str, str]) -> bool:
+    if device['device_type'].endswith('_serial'):
+        return True  # 串口设备没有网络端口可探测，交给连接阶段处理
+    port = 23 if device['device_type'].endswith('_telnet') else 22
+    try:
+        with socket.create_connection((device['host'], port), timeout=PORT_PROBE_TIMEOUT):
+            return True
+    except OSError:
+        return False
+
+def filter_reachable(devices: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """并发探测端口，返回可达的设备；不可达的记入错误日志"""
+    if PORT_PROBE_TIMEOUT <= 0 or not devices:
+        return devices
+    with ThreadPoolExecutor(max_workers=min(len(devices), PROBE_THREADS), thread_name_prefix='mdev-probe') as ex:
+        alive = list(ex.map(port_open, devices))
+    reachable = []
+    for dev, ok in zip(devices, alive):
+        if ok:
+            reachable.append(dev)
+        else:
+            log_error(dev['host'], "[SKIP] 端口不可达")
+    return reachable
 
 def batch_execute(
     devices: List[Dict[str, str]],
@@ -170,53 +325,98 @@ def batch_execute(
     destination: str = './'
 ) -> None:
     """批量执行（带优雅终止）"""
+    # 输出目录只在开始时计算并创建一次，不再每台设备 makedirs
+    output_dir = os.path.join(destination, f"result_{datetime.datetime.now():%Y%m%d}")
+    os.makedirs(output_dir, exist_ok=True)
+    from tqdm import tqdm
+    get_netmiko()  # 在主线程导入完，工作线程不再争导入锁
+    writer = Thread(target=writer_loop, name="result-writer", daemon=True)
+    writer.start()
     try:
-        with ThreadPoolExecutor(
-            max_workers=max_workers,
-            initializer=thread_initializer
-        ) as executor:
-            futures = {executor.submit(execute_commands, dev, config_set): dev for dev in devices}
-            progress = tqdm(total=len(devices), desc="执行进度", unit="台")
+        stack_size(WORKER_STACK_SIZE)  # 只影响之后新建的线程
+    except (ValueError, RuntimeError):
+        pass
+    reachable = filter_reachable(devices)
+    workers = max(1, min(len(reachable), max_workers))
+    progress = tqdm(total=len(devices), desc="执行进度", unit="台",  # 合并重绘，不再每台都写终端
+                    mininterval=0.2, miniters=max(1, len(devices) // 200), smoothing=0.1)
+    progress.update(len(devices) - len(reachable))  # 不可达的已判失败
+    success = 0
 
+    def collect(done: "set[Future]") -> None:
+        """处理已完成的任务：保存结果、计数；结果随之释放"""
+        nonlocal success
+        for future in done:
+            dev = future.dev
             try:
-                for future in as_completed(futures):
-                    dev = futures[future]
-                    try:
-                        if (result := future.result()) is not None:
-                            save_result(dev['host'], dev.get('hostname', 'unknown'), result, destination)
-                    except Exception as e:
-                        log_error(dev['host'], str(e))
-                    finally:
-                        progress.update(1)
-                progress.close()
-                print(f"\n完成: 成功 {sum(1 for f in futures if f.result() is not None)}/{len(devices)}")
-            except KeyboardInterrupt:
-                progress.close()
-                executor.shutdown(wait=False, cancel_futures=True)
-                raise
-    except KeyboardInterrupt:
-        sys.exit(0)
+                if (result := future.result()) is not None:
+                    save_result(dev['host'], dev.get('hostname', 'unknown'), result, output_dir)
+                    success += 1
+            except Exception as e:
+                log_error(dev['host'], str(e))
+            finally:
+                progress.update(1)
+
+    prev_handler = signal.signal(signal.SIGINT, _on_sigint)
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mdev') as executor:
+            # 有界提交：最多领先 workers*2 个任务，Future 数量与并发度同阶，不随设备数增长
+            inflight: "set[Future]" = set()
+            # 按 device_type 稳定排序后提交：同类驱动集中执行，同类内保持 Excel 行序
+            for dev in sorted(reachable, key=lambda d: d['device_type']):
+                if len(inflight) >= workers * 2:
+                    done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if _stop.is_set():
+                    break
+                future = executor.submit(execute_commands, dev, config_set)
+                future.dev = dev
+                inflight.add(future)
+            while inflight:
+                if _stop.is_set():
+                    # 排队未开始的直接取消；已在跑的会话看到停止标志后自行返回
+                    inflight = {f for f in inflight if not f.cancel()}
+                done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                collect(done)
+        progress.close()
+        print(f"\n完成: 成功 {success}/{len(devices)}")
+    finally:
+        signal.signal(signal.SIGINT, prev_handler)
+        result_queue.put(None)
+        writer.join()  # 等剩余结果全部落盘
+    if _stop.is_set():
+        sys.exit(130)
+
+def _on_sigint(signum, frame) -> None:
+    """首次 Ctrl+C：通知停止，未开始的设备不再执行，在途会话结束后结果照常落盘；
+    再按一次立即 os._exit(130)，不等收尾"""
+    if _stop.is_set():
+        os._exit(130)
+    _stop.set()
+    print("\n用户终止，等待在途会话结束（再按 Ctrl+C 立即退出）...")
 
 def parse_args() -> argparse.Namespace:
     """命令行参数解析"""
     parser = argparse.ArgumentParser(description="网络设备批量管理工具 v4.0", add_help=False, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-i', '--input', required=True, help='设备清单Excel路径')
-    parser.add_argument('-t', '--threads', type=int, default=DEFAULT_THREADS, help=f'并发线程数 (默认: {DEFAULT_THREADS})')
+    parser.add_argument('-t', '--threads', type=int, default=DEFAULT_THREADS, help=f'最大并发线程数 (默认: {DEFAULT_THREADS}，实际取 min(设备数, 该值))')
     parser.add_argument('-cs', '--config_set', action='store_true', help='使用配置模式发送命令')
     parser.add_argument('-d', '--destination', default='./', help='结果保存路径 (默认: 当前目录)')
     parser.add_argument('--debug', action='store_true', help='启用调试日志')
     parser.add_argument('-s', '--sheet', default='Sheet1', help='指定Excel工作表名称')
+    parser.add_argument('--safe-delays', action='store_true', help='关闭 fast_cli，恢复保守延迟（老旧或响应慢的设备）')
     if '--help' in sys.argv or '-h' in sys.argv:
-        print("""
+        print(f"""
 使用方法:
   connexec -i <设备清单.xlsx> [-t 并发数]
 
 参数说明:
   -i, --input        必需  Excel文件路径
-  -t, --threads      可选  并发线程线程（最小值1，默认4）
+  -t, --threads      可选  并发线程数（最小值1，默认{DEFAULT_THREADS}，实际取 min(设备数, 该值)）
   -cs, --config_set  可选  自动进入设备配置模式，并发送命令
   -d, --destination  可选  保存输出结果的目标目录路径，默认: 当前目录
   -s, --sheet        可选  指定excel中的sheet名称，默认: Sheet1
+  --safe-delays      可选  关闭 fast_cli，恢复保守延迟（老旧或响应慢的设备）
 
 示例Excel格式:
 +-------------+----------+------------+--------------+--------+----------+------------------------+
@@ -235,7 +435,12 @@ https://github.com/ktbyers/netmiko/blob/develop/PLATFORMS.md
 
 def main() -> None:
     """主入口"""
+    global SAFE_DELAYS
     args = parse_args()
+    SAFE_DELAYS = args.safe_delays
+    if args.threads > MAX_THREADS:
+        print(f"[WARN] -t {args.threads} 超过上限，按 {MAX_THREADS} 执行（MDEV_MAX_THREADS 可调整）")
+        args.threads = MAX_THREADS
     
     if not os.path.exists(args.input):
         print(f"错误: 文件不存在 [{args.input}]")
@@ -250,6 +455,9 @@ def main() -> None:
                 device['debug'] = True
         
         print(f"成功加载设备: {len(devices)} 台 (工作表: {args.sheet})")
+        if len(merged := coalesce_devices(devices)) < len(devices):
+            print(f"合并重复设备: {len(devices)} 行 -> {len(merged)} 台")
+            devices = merged
         batch_execute(devices, args.config_set, args.threads, args.destination)
     except KeyboardInterrupt:
         print("\n用户终止")